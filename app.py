@@ -11,6 +11,8 @@ def get_parser():
                      help='push to the registry')
     gp1.add_argument('--test', action='store_true', default=False,
                      help='test the pod image')
+    parser.add_argument('--test-timeout', type=int, default=300,
+                        help='hard deadline in seconds for each image test check')
     parser.add_argument('--error-on-empty', action='store_true', default=False,
                         help='stop and raise error when the target is empty, otherwise just gracefully exit')
     parser.add_argument('--reason', type=str, nargs='*',
@@ -19,8 +21,61 @@ def get_parser():
                         help='check if there is anything to update')
     parser.add_argument('--bleach-first', action='store_true', default=False,
                         help='clear docker before starting the build')
+    parser.add_argument('--cache-dir', type=str,
+                        help='keep a persistent buildx layer cache in this directory instead of building cold')
+    parser.add_argument('--cache-budget', type=float, default=20.0,
+                        help='disk budget of the build cache in GB, least recently used targets are evicted above it')
     parser.add_argument('--update-strategy', type=str,
                         help='set update strategy for this build')
+    parser.add_argument('--label-mode', type=str, choices=['buildx', 'dockerfile'], default='buildx',
+                        help='how manifest labels are attached to the image without breaking the layer cache')
+    parser.add_argument('--jina-context', type=str, choices=['shared', 'copy'], default='shared',
+                        help='pass the jina source as a shared named build context or copy it into every target')
+    parser.add_argument('--platform-mode', type=str, choices=['joint', 'split'], default='joint',
+                        help='build all platforms of a target in one buildx call or each in its own concurrent one')
+    parser.add_argument('--context-mode', type=str, choices=['minimal', 'full'], default='minimal',
+                        help='send buildx only the files the Dockerfile copies, or the whole target directory')
+    parser.add_argument('--context-warn-mb', type=float, default=500,
+                        help='warn when the build context of a target is larger than this many MB')
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='print the build plan grouped by base image and exit without building')
+    parser.add_argument('--keep-builds', type=int, default=50,
+                        help='number of raw ImageBuilds entries kept per image, older ones are rolled into stats')
+    parser.add_argument('--build-stats-period', type=str, choices=['daily', 'weekly'], default='weekly',
+                        help='period of the ImageBuildStats counters older builds are rolled into')
+    parser.add_argument('--compact-history', action='store_true', default=False,
+                        help='apply the build log retention to the whole history, save it and exit')
+    parser.add_argument('--run-id', type=str,
+                        help='id of this run for checkpointing, defaults to the update strategy, target and hub HEAD')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='skip targets already completed by an interrupted run with the same run id')
+    parser.add_argument('--metrics-file', type=str,
+                        help='export per-phase build timings, as a Prometheus textfile if it ends with .prom, '
+                             'appended as JSON lines otherwise')
+    parser.add_argument('--discovery-index', action='store_true', default=False,
+                        help='cache the hub directory listing keyed by directory mtime to speed up discovery')
+    parser.add_argument('--log-dir', type=str,
+                        help='directory of the gzipped build log of every target, defaults to .cache/logs')
+    parser.add_argument('--log-tail', type=int, default=50,
+                        help='number of last lines of a failing step kept in the image history')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of targets to build concurrently')
+    parser.add_argument('--watch', action='store_true', default=False,
+                        help='keep running and build targets as their files change in the hub checkout')
+    parser.add_argument('--watch-interval', type=float, default=30,
+                        help='seconds between two polls of the hub checkout in watch mode')
+    parser.add_argument('--watch-debounce', type=float, default=10,
+                        help='seconds the files of a target must stay unchanged before it is queued in watch mode')
+    parser.add_argument('--shard', type=str,
+                        help='build only the i-th of N duration-balanced parts of the targets, as i/N')
+    parser.add_argument('--shard-history', type=str,
+                        help='where a shard writes its partial history, defaults to .cache/shards/<i>-of-<N>.json')
+    parser.add_argument('--merge-history', type=str, nargs='+',
+                        help='merge the partial histories of shards into the api files and database and exit')
+    parser.add_argument('--registry', type=str, default='jinaai/',
+                        help='registry and namespace prefix of the image names')
+    parser.add_argument('--skip-existing', action='store_true', default=False,
+                        help='with --push, only retag images whose inputs were already pushed under a content tag')
     return parser
 
 
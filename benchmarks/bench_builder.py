@@ -0,0 +1,241 @@
+"""Benchmarks of the builder orchestration layer on a synthetic hub.
+
+Every size gets a fresh root with a copy of ``app.py`` and ``builder/``, a ``hub`` git repo holding the
+requested number of targets and commits, a synthetic build history and stub ``docker``/``jina`` executables
+on ``PATH``. The stages are then timed in a child interpreter running from that root, so nothing here ever
+touches docker, the network or the real hub.
+
+    python benchmarks/bench_builder.py --sizes 10 1000 10000 --output bench-results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import tempfile
+import subprocess
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+child_code = r'''
+import os
+import sys
+import json
+import time
+import contextlib
+
+results = {}
+
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+    results[name] = round(time.perf_counter() - start, 4)
+
+
+with stage('import'):
+    import app
+    from builder.modules.build import Builder
+    from builder.modules.load import StateLoader
+    from builder.modules.target import Target
+    from builder.modules.valid import Validator
+
+with stage('check_targets'):
+    import subprocess
+    subprocess.call([sys.executable, 'app.py', '--check-targets', '--update-strategy', 'nightly'],
+                    stdout=subprocess.DEVNULL)
+
+args = app.get_parser().parse_args(['--update-strategy', 'nightly'])
+builder = Builder(args)
+
+with stage('discovery'):
+    hub_files = list(builder.discovery.iter_files())
+state = StateLoader()
+
+with stage('load_history'):
+    history = state.get_history()
+
+with stage('get_targets'):
+    targets = sorted(builder.get_targets(history, get_all=True))
+
+with stage('load_manifests'):
+    loaded = [Target(path) for path in targets]
+
+# the second pass is served from the manifest cache, as on every run after the first one
+with stage('load_manifests_cached'):
+    loaded = [Target(path) for path in targets]
+
+with stage('validation'):
+    for target in loaded:
+        Validator(target)
+
+with stage('update_history'):
+    now = int(time.time())
+    for target in loaded:
+        builder.update_history(history, {
+            'ImageName': target.canonic_name,
+            'ImageStatus': True,
+            'LastBuildTime': now,
+            'LastBuildDuration': 1,
+            'ImageBuilds': {str(now): True},
+        })
+
+with stage('update_total_history'):
+    state.update_total_history(history, builder.updated_images)
+
+results['targets'] = len(targets)
+results['hub_files'] = len(hub_files)
+with open(sys.argv[1], 'w') as fp:
+    json.dump(results, fp)
+'''
+
+stub_docker = '#!/bin/sh\necho "stub docker $*" >&2\nexit 0\n'
+stub_jina = '#!/bin/sh\necho "stub jina $*" >&2\nexit 0\n'
+
+manifest_template = '''name: bench{index}
+description: synthetic target {index}
+author: bench
+version: 0.0.{index}
+license: apache-2.0
+update: nightly
+'''
+
+dockerfile_template = '''FROM jinaai/jina:{base}
+COPY . /workspace
+WORKDIR /workspace
+ENTRYPOINT ["jina", "pod", "--uses", "config.yml"]
+'''
+
+
+def git(cwd, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@jina.ai',
+               GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@jina.ai')
+    subprocess.check_call(['git', '-C', cwd] + list(args), env=env, stdout=subprocess.DEVNULL)
+
+
+def make_root(root, size, files_per_target, commits, seed):
+    rnd = random.Random(seed)
+    shutil.copy(os.path.join(repo_dir, 'app.py'), root)
+    shutil.copytree(os.path.join(repo_dir, 'builder'), os.path.join(root, 'builder'),
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    git(root, 'init', '-q')
+    git(root, 'add', '-A')
+    git(root, 'commit', '-qm', 'builder')
+
+    hub_dir = os.path.join(root, 'hub')
+    files = []
+    for index in range(size):
+        target_dir = os.path.join(hub_dir, 'hub', 'executors', 'bench', f'group{index % 50}', f'target{index}')
+        os.makedirs(target_dir)
+        contents = {
+            'manifest.yml': manifest_template.format(index=index),
+            'Dockerfile': dockerfile_template.format(base=rnd.choice(['0.5.0', '0.5.5', 'devel'])),
+            'config.yml': f'!BenchEncoder\nwith:\n  index: {index}\n',
+            '__init__.py': f'INDEX = {index}\n',
+        }
+        for extra in range(max(0, files_per_target - len(contents))):
+            contents[f'module{extra}.py'] = f'VALUE = {extra}\n'
+        for name, content in contents.items():
+            with open(os.path.join(target_dir, name), 'w') as fp:
+                fp.write(content)
+            files.append(os.path.join(target_dir, name))
+    git(hub_dir, 'init', '-q')
+    git(hub_dir, 'add', '-A')
+    git(hub_dir, 'commit', '-qm', 'hub')
+    for commit in range(commits):
+        for file_path in rnd.sample(files, min(len(files), 10)):
+            with open(file_path, 'a') as fp:
+                fp.write(f'# commit {commit}\n')
+        git(hub_dir, 'commit', '-qam', f'commit {commit}')
+
+    os.makedirs(os.path.join(root, 'api', 'hub'))
+    os.makedirs(os.path.join(root, 'status'))
+    with open(os.path.join(root, 'status', 'README.md'), 'w') as fp:
+        fp.write('# Hub status\n\n<!-- START_BUILD_BADGE --><!-- END_BUILD_BADGE -->\n')
+    images = {}
+    for index in range(0, size, 2):
+        name = f'hub.executors.bench.group{index % 50}.target{index}'
+        images[name] = {
+            'ImageName': name,
+            'ImageStatus': True,
+            'LastBuildTime': 1,
+            'LastBuildDuration': rnd.randint(30, 3000),
+            'ImageBuilds': {str(stamp): True for stamp in range(1, 1 + 20)},
+        }
+    with open(os.path.join(root, 'api', 'hub', 'package'), 'w') as fp:
+        json.dump(images, fp)
+    with open(os.path.join(root, 'api', 'hub', 'status'), 'w') as fp:
+        json.dump({'LastBuildTime': 1, 'LastBuildStatus': {k: True for k in images}, 'LastBuildReason': ''}, fp)
+
+    bin_dir = os.path.join(root, '.bench-bin')
+    os.makedirs(bin_dir)
+    for name, content in (('docker', stub_docker), ('jina', stub_jina)):
+        with open(os.path.join(bin_dir, name), 'w') as fp:
+            fp.write(content)
+        os.chmod(os.path.join(bin_dir, name), 0o755)
+    return bin_dir
+
+
+def run_size(size, files_per_target, commits, seed, keep):
+    root = tempfile.mkdtemp(prefix=f'hub-bench-{size}-')
+    try:
+        start = time.perf_counter()
+        bin_dir = make_root(root, size, files_per_target, commits, seed)
+        setup = time.perf_counter() - start
+        results_path = os.path.join(root, 'results.json')
+        env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''), PYTHONPATH=root)
+        env.pop('MONGODB_CREDENTIALS', None)
+        subprocess.check_call([sys.executable, '-c', child_code, results_path], cwd=root, env=env,
+                              stdout=subprocess.DEVNULL)
+        with open(results_path) as fp:
+            results = json.load(fp)
+        results['setup'] = round(setup, 4)
+        return results
+    finally:
+        if keep:
+            print(f'kept synthetic root {root}')
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='benchmark the builder orchestration layer on a synthetic hub')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000],
+                        help='numbers of targets to benchmark')
+    parser.add_argument('--files-per-target', type=int, default=4,
+                        help='files in every target, at least manifest, Dockerfile, config and __init__')
+    parser.add_argument('--commits', type=int, default=20,
+                        help='commits on top of the initial hub commit')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default='bench-results.json',
+                        help='where to write the machine-readable results')
+    parser.add_argument('--keep', action='store_true', default=False,
+                        help='keep the synthetic roots for inspection')
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    report = {
+        'python': sys.version.split()[0],
+        'timestamp': int(time.time()),
+        'files_per_target': args.files_per_target,
+        'commits': args.commits,
+        'results': {},
+    }
+    for size in args.sizes:
+        results = run_size(size, args.files_per_target, args.commits, args.seed, args.keep)
+        report['results'][str(size)] = results
+        stages = ', '.join(f'{k} {v:.3f}s' for k, v in results.items() if isinstance(v, float))
+        print(f'{size:>6} targets: {stages}')
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
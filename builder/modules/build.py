@@ -1,13 +1,29 @@
 import os
 import time
+import threading
 import subprocess
 
 from pathlib import Path
 from ruamel.yaml import YAML
 
 from builder.modules.valid import Validator
-from builder.modules.load import StateLoader
+from builder.modules.load import StateLoader, ImageHistory, get_image_summary
 from builder.modules.target import Target
+from builder.modules.manifest import ManifestLoader
+from builder.modules.index import RepoIndex, GitIndex
+from builder.modules.schedule import Scheduler
+from builder.modules.fingerprint import Fingerprint
+from builder.modules.cache import BuildCache
+from builder.modules.plan import BuildPlan
+from builder.modules.preflight import Preflight
+from builder.modules.retention import BuildLogRetention
+from builder.modules.journal import Journal
+from builder.modules.timer import RunMetrics
+from builder.modules.discovery import HubDiscovery
+from builder.modules.shard import Shard
+from builder.modules.registry import RegistryClient
+from builder.modules.log import BuildLog, log_dir
+from builder.modules.watch import HubWatcher
 from builder.color_print import *
 
 yaml = YAML()
@@ -17,44 +33,174 @@ root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 builder_files = list(Path(root_dir).glob('app.py')) + \
                 list(Path(root_dir).glob('builder/*.yml'))
 
-valid_files = list(Path(root_dir).glob('hub/hub/**/*.y*ml')) + \
-              list(Path(root_dir).glob('hub/hub/**/*Dockerfile')) + \
-              list(Path(root_dir).glob('hub/hub/**/*.py'))
-ignore_files = list(Path(root_dir).glob('hub/hub/**/jina/**/*')) + \
-               list(Path(root_dir).glob('hub/hub/.github/**/*')) + \
-               list(Path(root_dir).glob('hub/hub/builder/**/*'))
-hub_files = list(set(valid_files) - set(ignore_files))
-
 
 class Builder:
 
+    lock = threading.Lock()
+    _common_keys = None
+
     def __init__(self, args):
         self.args = args
+        self._index = None
+        self._fingerprint = None
+        self.cache = BuildCache(args.cache_dir, args.cache_budget) if args.cache_dir else None
+        self.updated_images = set()
+        self.retention = BuildLogRetention(args.keep_builds, args.build_stats_period)
+        self.completed = set()
+        self.discovery = HubDiscovery(use_index=args.discovery_index)
+        self.shard = Shard.parse(args.shard) if args.shard else None
+        self.journal = Journal(self.get_run_id())
+        self.metrics = RunMetrics(self.journal.run_id)
+        self.registry_client = RegistryClient.from_env() if args.skip_existing else None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = RepoIndex(root_dir, os.path.join(root_dir, 'hub'))
+        return self._index
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = Fingerprint(builder_files)
+        return self._fingerprint
+
+    def get_run_id(self):
+        if self.args.run_id:
+            return self.args.run_id
+        hub_dir = os.path.join(root_dir, 'hub')
+        head = GitIndex.get_head(hub_dir if os.path.isdir(hub_dir) else root_dir) or 'nohead'
+        scope = Target.get_canonic_name(self.args.target) if self.args.target else 'all'
+        run_id = f'{self.args.update_strategy or "test"}-{scope}-{head[:12]}'
+        return f'{run_id}-shard{self.shard.index}of{self.shard.count}' if self.shard else run_id
 
     def run(self):
+        if self.args.check_targets:
+            self.check_targets()
         state = StateLoader()
         history = state.get_history()
+        if self.args.compact_history:
+            self.compact_history(state, history)
+            return
+        if self.args.merge_history:
+            self.merge_history(state, history)
+            return
+        if self.args.resume:
+            for name, image_map in self.journal.restore().items():
+                self.update_history(history, image_map)
+                self.completed.add(name)
+        if self.args.watch:
+            self.watch(state, history)
+            return
         if self.args.target:
             target = Target(self.args.target)
-            self.build_single(target, history)
+            if self.args.dry_run:
+                BuildPlan([target]).print_plan([target])
+                return
+            if target.canonic_name in self.completed:
+                print(print_green('Already built in this run ') + target.canonic_name)
+            else:
+                self.build_single(target, history)
         else:
             get_all = False
             if self.args.update_strategy == 'on-release':
                 get_all = True
             targets = self.get_targets(history, get_all)
-            if self.args.check_targets:
-                if len(targets) == 0:
-                    print(print_green('Nothing to build'))
-                    exit(1)
-                else:
-                    exit(0)
-            for path in targets:
-                target = Target(path)
-                if self.check_update_strategy(target):
-                    if self.args.bleach_first:
-                        self.clean_docker()
-                    self.build_single(target, history)
-        state.update_total_history(history)
+            if self.shard:
+                targets = self.shard.select(targets, history, Target.get_canonic_name)
+            self.build_multiple(targets, history)
+            if self.args.dry_run:
+                return
+        self.metrics.print_summary()
+        if self.args.metrics_file:
+            self.metrics.export(self.args.metrics_file)
+        if self.shard:
+            # the runner merging all shards writes the api files and the database
+            self.shard.save(history, self.updated_images, self.args.shard_history, self.journal.run_id)
+        else:
+            state.update_total_history(history, self.updated_images)
+        self.journal.discard()
+
+    def check_targets(self):
+        # a CI gate: local history and the git/discovery indexes only, no database and no manifest parsing
+        history = StateLoader(connect=False).get_history()
+        targets = self.get_targets(history, get_all=self.args.update_strategy == 'on-release')
+        if self.shard:
+            targets = self.shard.select(targets, history, Target.get_canonic_name)
+        if len(targets) == 0:
+            print(print_green('Nothing to build'))
+            exit(1)
+        else:
+            exit(0)
+
+    def compact_history(self, state, history):
+        if isinstance(history['Images'], ImageHistory):
+            history['Images'] = history['Images'].materialize()
+        compacted = self.retention.compact_history(history)
+        print(print_green(f'Compacted build logs of {compacted} images'))
+        state.update_history_on_db(history)
+        state.update_api(history)
+
+    def watch(self, state, history):
+        # commits reaching the hub checkout are what a watcher reacts to
+        self.args.update_strategy = self.args.update_strategy or 'on-master'
+        if not self.discovery.use_index:
+            self.discovery = HubDiscovery(use_index=True)
+        targets = self.get_targets(history, get_all=False)
+        if self.shard:
+            targets = self.shard.select(targets, history, Target.get_canonic_name)
+        # builds run in scheduler threads, read the shared rule and manifest files up front
+        Validator.preload()
+        self.common_keys()
+        HubWatcher(self, state, history, self.args.watch_interval, self.args.watch_debounce).run(targets)
+
+    def merge_history(self, state, history):
+        merged = Shard.merge(history, self.args.merge_history)
+        print(print_green(f'Merged {len(merged)} images from {len(self.args.merge_history)} partial histories'))
+        state.update_total_history(history, merged)
+
+    def build_multiple(self, targets, history):
+        jobs = self.args.jobs or 1
+        targets = [path for path in targets if Target.get_canonic_name(path) not in self.completed]
+        # targets the update strategy skips are neither validated nor recorded as failed
+        targets = [path for path in targets if self.check_path_strategy(path)]
+        valid, failures = Preflight().run(targets)
+        if not self.args.dry_run and failures:
+            for path, error in failures.items():
+                self.record_invalid(history, path, error)
+            self.journal.checkpoint(history, self.updated_images)
+
+        selected = [Target(path) for path in valid]
+        self.common_keys()
+
+        plan = BuildPlan(selected)
+        scheduler = Scheduler(self.build_target, history, jobs=jobs, plan=plan, error_fn=self.get_build_error_map)
+        ordered = scheduler.order(selected)
+        if self.args.dry_run:
+            plan.print_plan(ordered)
+            return
+        if not self.args.bleach_first:
+            plan.pull_bases(jobs=max(jobs, 4), cache=self.cache)
+
+        if jobs == 1:
+            for target in ordered:
+                if self.args.bleach_first:
+                    self.clean_docker()
+                self.build_single(target, history)
+        else:
+            if self.args.bleach_first:
+                # cleaning between targets would kill the builds running next to it
+                self.clean_docker()
+                plan.pull_bases(jobs=max(jobs, 4), cache=self.cache)
+            scheduler.run(ordered, on_done=lambda target, image_map: self.on_build_done(history, target, image_map),
+                          ordered=True)
+
+    def on_build_done(self, history, target, image_map):
+        self.update_history(history, image_map)
+        self.metrics.add(image_map)
+        self.journal.checkpoint(history, self.updated_images)
+        if self.cache:
+            self.cache.collect()
 
     @staticmethod
     def clean_docker():
@@ -72,38 +218,83 @@ class Builder:
                 pass
 
     def build_single(self, target, history):
+        image = history.get('Images', {}).get(target.canonic_name, {})
+        try:
+            image_map = self.build_target(target, image)
+        except Exception as e:
+            image_map = self.get_build_error_map(target, image, e)
+        self.on_build_done(history, target, image_map)
+
+    def get_build_error_map(self, target, image, error):
+        print(print_red(error) + f' while building {target.canonic_name}')
+        return self.get_failed_image_map(target.canonic_name, image, 'BuildError', f'{type(error).__name__}: {error}',
+                                         target.path)
+
+    def build_target(self, target, image):
         output = None
         status = False
         start = int(time.time())
+        fingerprint = self.fingerprint.get(target.path)
+        log_path = os.path.join(self.args.log_dir or log_dir, f'{target.canonic_name}.log.gz')
+        # concurrent builds on one console are unreadable, they only go to their log files
+        target.log = BuildLog(log_path, tail=self.args.log_tail, echo=(self.args.jobs or 1) == 1)
         try:
-            validator = Validator(target)
+            with target.timer.phase('validation'):
+                validator = Validator(target)
             try:
-                output = target.build_image(push=self.args.push, test=self.args.test)
+                output = target.build_image(push=self.args.push, test=self.args.test,
+                                            label_mode=self.args.label_mode,
+                                            jina_context=self.args.jina_context,
+                                            cache=self.cache,
+                                            test_timeout=self.args.test_timeout,
+                                            platform_mode=self.args.platform_mode,
+                                            docker_registry=self.args.registry,
+                                            fingerprint=fingerprint if self.args.skip_existing else None,
+                                            registry_client=self.registry_client,
+                                            context_mode=self.args.context_mode,
+                                            context_warn_mb=self.args.context_warn_mb)
                 status = True
             except Exception as e:
-                print(print_red(e) + f' while building {target.canonic_name}')
+                print(print_red(e) + f' while building {target.canonic_name}, full log in {log_path}')
+                if not target.log.echo and target.log.failures:
+                    print(target.log.get_excerpt())
         except Exception as e:
             print(print_red(e) + f' while validating {target.canonic_name}')
+        finally:
+            target.log.close()
 
         finish = int(time.time())
         duration = finish - start
-        image = history.get('Images', {}).get(target.canonic_name, {})
         build_log = image.get('ImageBuilds', {})
         build_log.update({str(finish): status})
+        build_durations = image.get('ImageBuildDurations', {})
+        build_durations.update({str(finish): duration})
         image_map = {
             'ImageName': target.canonic_name,
             'ImageStatus': status,
             'LastBuildTime': finish,
             'LastBuildDuration': duration,
             'Inspect': output or image.get('Inspect'),
-            'ImageBuilds': build_log
+            'Fingerprint': fingerprint,
+            'LastGoodFingerprint': fingerprint if status else image.get('LastGoodFingerprint'),
+            'Tests': target.test_report or image.get('Tests'),
+            'Platforms': target.platform_report or image.get('Platforms'),
+            'ContentImage': target.content_image_name or image.get('ContentImage'),
+            'BuildLog': log_path,
+            'ContextSize': target.context.size if target.context else image.get('ContextSize'),
+            'ContextFiles': len(target.context.files) if target.context else image.get('ContextFiles'),
+            'FailedSteps': target.log.failures or None,
+            'Phases': target.timer.as_dict(),
+            'ImageBuilds': build_log,
+            'ImageBuildDurations': build_durations,
+            'ImageBuildStats': image.get('ImageBuildStats', {})
         }
         fields_from_target_manifest = self.image_related_keys(target.manifest)
         fields_from_repo_manifest = self.common_keys()
         image_map['Manifest'] = {}
         image_map['Manifest'].update(**fields_from_target_manifest)
         image_map['Manifest'].update(**fields_from_repo_manifest)
-        self.update_history(history, target, image_map)
+        return self.retention.compact(image_map)
 
     @staticmethod
     def image_related_keys(manifest):
@@ -113,8 +304,16 @@ class Builder:
             'source': manifest.get('source'),
         }
 
+    @classmethod
+    def common_keys(cls):
+        # builds run in scheduler threads, and a ruamel instance keeps its parser state between loads
+        with cls.lock:
+            if cls._common_keys is None:
+                cls._common_keys = cls.load_common_keys()
+            return dict(cls._common_keys)
+
     @staticmethod
-    def common_keys():
+    def load_common_keys():
         builder_manifest_path = os.path.join(root_dir, 'builder', 'manifest.yml')
         with open(builder_manifest_path) as yml:
             source_manifest = yaml.load(yml)
@@ -131,24 +330,71 @@ class Builder:
             }
         return fields
 
-    def update_history(self, history, target, image_map):
-        history['Images'][target.canonic_name] = image_map
-        history['LastBuildStatus'][target.canonic_name] = image_map['ImageStatus']
+    def record_invalid(self, history, path, error):
+        canonic_name = Target.get_canonic_name(path)
+        image = history['Images'].get(canonic_name, {})
+        image_map = self.get_failed_image_map(canonic_name, image, 'ValidationError', error, path)
+        self.update_history(history, image_map)
+
+    def get_failed_image_map(self, canonic_name, image, error_key, error, path=None):
+        """Image map of a target that failed before ``build_target`` could produce one."""
+        finish = int(time.time())
+        build_log = dict(image.get('ImageBuilds', {}))
+        build_log.update({str(finish): False})
+        image_map = dict(image)
+        image_map.update({
+            'ImageName': canonic_name,
+            'ImageStatus': False,
+            'LastBuildTime': finish,
+            error_key: error,
+            'ImageBuilds': build_log
+        })
+        if path is not None:
+            # the inputs of the failed attempt, so the target waits for a change before it is tried again
+            image_map['Fingerprint'] = self.get_target_fingerprint(path)
+        return self.retention.compact(image_map)
+
+    def get_target_fingerprint(self, path):
+        try:
+            return self.fingerprint.get(path)
+        except Exception:
+            return None
+
+    def is_up_to_date(self, image, path):
+        """Whether the inputs of ``path`` are those of its last build: the last good one for a built image,
+        the failed attempt for a failing one, which is only retried once its inputs change."""
+        if image.get('ImageStatus'):
+            fingerprint = image.get('LastGoodFingerprint') or image.get('Fingerprint')
+        else:
+            fingerprint = image.get('Fingerprint')
+        return fingerprint is not None and fingerprint == self.get_target_fingerprint(path)
+
+    def update_history(self, history, image_map):
+        history['Images'][image_map['ImageName']] = image_map
+        self.updated_images.add(image_map['ImageName'])
+        history['LastBuildStatus'][image_map['ImageName']] = image_map['ImageStatus']
         history['LastBuildTime'] = image_map['LastBuildTime']
         history['LastBuildReason'] = self.args.reason or self.args.update_strategy or 'test'
 
     def get_targets(self, history, get_all):
         to_be_updated_targets = set()
         builder_updated_timestamp = self.get_builder_update_history()
+        canonic_names = {}
 
-        for file_path in hub_files:
+        for file_path in self.discovery.iter_files():
             target = os.path.dirname(os.path.abspath(file_path))
-            canonic_name = Target.get_canonic_name(target)
+            if target not in canonic_names:
+                canonic_names[target] = Target.get_canonic_name(target)
+            canonic_name = canonic_names[target]
 
             modified_time = self.get_modified_time(file_path)
-            last_build_timestamp = int(history['Images'].get(canonic_name, {}).get('LastBuildTime', 0))
+            image = get_image_summary(history, canonic_name)
+            last_build_timestamp = int(image.get('LastBuildTime', 0))
             is_target_to_be_added = False
-            if builder_updated_timestamp > last_build_timestamp or modified_time > last_build_timestamp:
+            if image.get('Fingerprint'):
+                if not self.is_up_to_date(image, target):
+                    is_target_to_be_added = True
+            elif builder_updated_timestamp > last_build_timestamp or modified_time > last_build_timestamp:
                 is_target_to_be_added = True
 
             if is_target_to_be_added or get_all:
@@ -159,11 +405,10 @@ class Builder:
 
         return to_be_updated_targets
 
-    @staticmethod
-    def get_modified_time(file_path) -> int:
-        r = subprocess.check_output(['git', 'log', '-1', '--pretty=%at', str(file_path)]).strip().decode()
+    def get_modified_time(self, file_path) -> int:
+        r = self.index.get_modified_time(file_path)
         if r:
-            return int(r)
+            return r
         else:
             print(print_red(f'\nCan\'t fetch modified time of {file_path}, is it under git?'))
             return 0
@@ -182,6 +427,19 @@ class Builder:
         return last_builder_update_timestamp
 
     def check_update_strategy(self, target):
+        return self.check_strategy(target.manifest.get('update', 'nightly'), target.canonic_name)
+
+    def check_path_strategy(self, path):
+        """Strategy check of a target that may not load, read from its manifest alone."""
+        try:
+            manifest, _ = ManifestLoader.load(os.path.join(path, 'manifest.yml'))
+            target_strategy = manifest.get('update', 'nightly')
+        except Exception:
+            # the preflight reports why, as for any target following the default strategy
+            target_strategy = 'nightly'
+        return self.check_strategy(target_strategy, Target.get_canonic_name(path))
+
+    def check_strategy(self, target_strategy, canonic_name):
 
         event_map = {
             'force': 0,
@@ -199,7 +457,6 @@ class Builder:
             'on-master': 50
         }
 
-        target_strategy = target.manifest.get('update', 'nightly')
         current_strategy = self.args.update_strategy
         try:
             event_level = event_map[current_strategy]
@@ -207,5 +464,5 @@ class Builder:
             if event_level <= update_level:
                 return True
         except KeyError as e:
-            print(print_red(f'{e} is not valid strategy for ') + target.canonic_name)
+            print(print_red(f'{e} is not valid strategy for ') + canonic_name)
 
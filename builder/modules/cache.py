@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import shutil
+import threading
+import subprocess
+
+from builder.color_print import *
+
+
+class BuildCache:
+    """Persistent buildx layer cache with a disk budget.
+
+    Every target gets its own local cache directory, used as ``--cache-from``/``--cache-to`` for its builds.
+    A ledger in the cache directory keeps the last-use time of every target and the size of its cache
+    directory, measured once when the target is released. When the directories exceed the budget, the least
+    recently used targets are evicted, along with the images built from them, until the budget holds again.
+    Built images are not counted: their layers are shared with their bases and other images, so their sizes
+    don't add up; the builder's own store is pruned to the budget instead. Base images pre-pulled into the
+    docker image store are counted, as entries of their own.
+    """
+
+    def __init__(self, cache_dir, budget_gb=20.0):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.budget = int(budget_gb * 1024 ** 3)
+        self.ledger_path = os.path.join(self.cache_dir, 'ledger.json')
+        self.in_use = set()
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.ledger = self.load_ledger()
+
+    def load_ledger(self):
+        if os.path.isfile(self.ledger_path):
+            with open(self.ledger_path) as fp:
+                try:
+                    return json.load(fp)
+                except ValueError:
+                    print(print_red('Broken cache ledger ') + self.ledger_path + ', starting a new one')
+        return {}
+
+    def save_ledger(self):
+        with open(self.ledger_path + '.tmp', 'w') as fp:
+            json.dump(self.ledger, fp)
+        os.replace(self.ledger_path + '.tmp', self.ledger_path)
+
+    def get_target_dir(self, canonic_name):
+        return os.path.join(self.cache_dir, canonic_name)
+
+    def acquire(self, canonic_name):
+        with self.lock:
+            self.in_use.add(canonic_name)
+        target_dir = self.get_target_dir(canonic_name)
+        cache_args = []
+        if os.path.isfile(os.path.join(target_dir, 'index.json')):
+            cache_args += ['--cache-from', f'type=local,src={target_dir}']
+        # the local exporter never drops stale blobs, so export into a fresh dir and swap it in afterwards
+        cache_args += ['--cache-to', f'type=local,dest={target_dir}.new,mode=max']
+        return cache_args
+
+    def release(self, canonic_name, images, success):
+        target_dir = self.get_target_dir(canonic_name)
+        if success and os.path.isdir(target_dir + '.new'):
+            shutil.rmtree(target_dir, ignore_errors=True)
+            os.replace(target_dir + '.new', target_dir)
+        else:
+            shutil.rmtree(target_dir + '.new', ignore_errors=True)
+        entry = {'LastUsed': int(time.time()), 'Images': list(images), 'Size': self.get_dir_size(target_dir)}
+        with self.lock:
+            self.in_use.discard(canonic_name)
+            self.ledger[canonic_name] = entry
+            self.save_ledger()
+
+    def add_base(self, image):
+        entry = {'LastUsed': int(time.time()), 'Images': [image], 'Size': self.get_image_size(image), 'Base': True}
+        with self.lock:
+            self.ledger[f'base:{image}'] = entry
+            self.save_ledger()
+
+    @staticmethod
+    def get_image_size(image):
+        try:
+            r = subprocess.check_output(['docker', 'image', 'inspect', '--format', '{{.Size}}', image],
+                                        stderr=subprocess.DEVNULL)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return 0
+        return int(r.strip() or 0)
+
+    @staticmethod
+    def get_dir_size(path):
+        size = 0
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in file_names:
+                try:
+                    size += os.lstat(os.path.join(dir_path, file_name)).st_size
+                except OSError:
+                    pass
+        return size
+
+    def evict(self, canonic_name):
+        print(print_yellow('Evicting build cache of ') + canonic_name)
+        entry = self.ledger.pop(canonic_name, {})
+        if not entry.get('Base'):
+            shutil.rmtree(self.get_target_dir(canonic_name), ignore_errors=True)
+        images = entry.get('Images', [])
+        if images:
+            subprocess.call(['docker', 'rmi', '-f'] + images, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def collect(self):
+        with self.lock:
+            for name, entry in self.ledger.items():
+                if 'Size' not in entry:
+                    # written before sizes were kept in the ledger, measure it once
+                    entry['Size'] = self.get_dir_size(self.get_target_dir(name))
+            total = sum(entry['Size'] for entry in self.ledger.values())
+            if total <= self.budget:
+                return
+            print(print_green('Build cache uses ') + f'{total / 1024 ** 3:.1f}GB of {self.budget / 1024 ** 3:.1f}GB')
+            lru = sorted((e.get('LastUsed', 0), name) for name, e in self.ledger.items() if name not in self.in_use)
+            for _, name in lru:
+                if total <= self.budget:
+                    break
+                total -= self.ledger[name]['Size']
+                self.evict(name)
+            self.save_ledger()
+            subprocess.call(['docker', 'image', 'prune', '-f'], stdout=subprocess.DEVNULL)
+            # the layers of the builds themselves live in the active builder, not in the docker image store
+            subprocess.call(['docker', 'buildx', 'prune', '-f', '--keep-storage', str(self.budget)],
+                            stdout=subprocess.DEVNULL)
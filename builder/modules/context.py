@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import shlex
+import shutil
+import hashlib
+import threading
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from builder.color_print import *
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+contexts_dir = os.path.join(root_dir, '.cache', 'contexts')
+hashes_path = os.path.join(root_dir, '.cache', 'context-hashes.json')
+
+# below this much uncached data, starting worker processes costs more than hashing inline
+pool_threshold = 64 * 1024 ** 2
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(chunk)
+    return file_path, digest.hexdigest()
+
+
+class IgnoreRules:
+    """``.dockerignore`` patterns, matched the way docker does.
+
+    The last matching pattern wins, ``!`` re-includes, and a pattern matching a directory covers everything below it.
+    """
+
+    def __init__(self, lines=()):
+        self.rules = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            include = line.startswith('!')
+            pattern = os.path.normpath(line.lstrip('!').strip().lstrip('/'))
+            self.rules.append((self.translate(pattern), include))
+
+    @classmethod
+    def load(cls, context_dir):
+        ignore_path = os.path.join(context_dir, '.dockerignore')
+        if not os.path.isfile(ignore_path):
+            return cls()
+        with open(ignore_path) as fp:
+            return cls(fp.readlines())
+
+    @staticmethod
+    def translate(pattern):
+        regex = ''
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith('**', i):
+                regex += '.*'
+                i += 2
+                if pattern.startswith('/', i):
+                    regex += '/?'
+                    i += 1
+                continue
+            ch = pattern[i]
+            regex += '[^/]*' if ch == '*' else '[^/]' if ch == '?' else re.escape(ch)
+            i += 1
+        return re.compile(f'^{regex}(/.*)?$')
+
+    def is_ignored(self, rel_path):
+        ignored = False
+        for regex, include in self.rules:
+            if regex.match(rel_path):
+                ignored = not include
+        return ignored
+
+
+class BuildContext:
+    """The part of a target directory its Dockerfile actually reads.
+
+    Sources of ``COPY``/``ADD`` instructions without ``--from`` are resolved against the target directory,
+    minus what ``.dockerignore`` excludes, and hard linked into ``.cache/contexts/<image>``, so buildx only
+    tars and sends those files. When the sources can't be resolved statically (build args in a source,
+    bind mounts of the context) or the Dockerfile copies the whole directory, the directory itself is used.
+    ``digest`` is only computed on request: file digests are cached by size and mtime, and new files are
+    hashed in a process pool, so it stays cheap for targets carrying model weights.
+    """
+
+    hashes = None
+    lock = threading.Lock()
+    instruction_regex = r'^(?P<cmd>COPY|ADD)\s+(?P<flags>(--\S+\s+)*)(?P<args>.*)$'
+
+    def __init__(self, target_dir, dockerfile_path, canonic_name, jobs=None):
+        self.target_dir = os.path.abspath(target_dir)
+        self.dockerfile_path = dockerfile_path
+        self.canonic_name = canonic_name
+        self.jobs = jobs or os.cpu_count() or 1
+        self.path = self.target_dir
+        self.files = []
+        self.size = 0
+        self.digest = None
+
+    @staticmethod
+    def read_instructions(dockerfile_path):
+        with open(dockerfile_path) as fp:
+            joined = re.sub(r'\\\n', ' ', fp.read())
+        return [line.strip() for line in joined.splitlines() if line.strip() and not line.strip().startswith('#')]
+
+    @classmethod
+    def get_sources(cls, dockerfile_path):
+        """Context paths the Dockerfile reads, ``None`` when they can't be told without running the build."""
+        sources = []
+        for line in cls.read_instructions(dockerfile_path):
+            if re.match(r'^RUN\s.*--mount=\S*type=bind', line, flags=re.IGNORECASE) and 'from=' not in line:
+                return None
+            m = re.match(cls.instruction_regex, line, flags=re.IGNORECASE)
+            if not m or '--from' in m.group('flags'):
+                continue
+            args = m.group('args').strip()
+            try:
+                words = json.loads(args) if args.startswith('[') else shlex.split(args)
+            except ValueError:
+                return None
+            for source in words[:-1]:
+                if '$' in source:
+                    return None
+                if m.group('cmd').upper() == 'ADD' and re.match(r'^(https?|git)://', source):
+                    continue
+                sources.append(os.path.normpath(source.lstrip('/')))
+        return sources
+
+    def select_files(self, sources, ignore):
+        patterns = None if '.' in sources else [IgnoreRules.translate(s) for s in sources]
+        # with a ! exception anything below an ignored directory may come back, so only prune without them
+        prune = not any(include for _, include in ignore.rules)
+        dockerfile = os.path.relpath(self.dockerfile_path, self.target_dir)
+        selected = []
+        for dir_path, dir_names, file_names in os.walk(self.target_dir):
+            rel_dir = os.path.relpath(dir_path, self.target_dir)
+            rel_dir = '' if rel_dir == '.' else rel_dir + '/'
+            dir_names[:] = sorted(d for d in dir_names if not (prune and ignore.is_ignored(rel_dir + d)))
+            for file_name in sorted(file_names):
+                rel_path = rel_dir + file_name
+                if rel_path == dockerfile or ignore.is_ignored(rel_path):
+                    continue
+                if patterns is None or any(p.match(rel_path) for p in patterns):
+                    selected.append(rel_path)
+        return selected
+
+    @classmethod
+    def load_hashes(cls):
+        if cls.hashes is None:
+            cls.hashes = {}
+            if os.path.isfile(hashes_path):
+                with open(hashes_path) as fp:
+                    try:
+                        cls.hashes = json.load(fp)
+                    except ValueError:
+                        pass
+        return cls.hashes
+
+    @classmethod
+    def save_hashes(cls):
+        os.makedirs(os.path.dirname(hashes_path), exist_ok=True)
+        tmp_path = f'{hashes_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(cls.hashes, fp)
+        os.replace(tmp_path, hashes_path)
+
+    def hash_files(self, stats):
+        with self.lock:
+            hashes = self.load_hashes()
+            todo = [p for p, st in stats.items() if hashes.get(p, [None, None])[:2] != [st.st_size, st.st_mtime_ns]]
+        if sum(stats[p].st_size for p in todo) > pool_threshold and len(todo) > 1 and self.jobs > 1:
+            # builds run in scheduler threads, and forking a threaded process is unsafe: spawn the workers
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(todo)),
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                results = list(pool.map(hash_file, todo))
+        else:
+            results = [hash_file(p) for p in todo]
+        with self.lock:
+            for file_path, digest in results:
+                hashes[file_path] = [stats[file_path].st_size, stats[file_path].st_mtime_ns, digest]
+            if results:
+                self.save_hashes()
+            return {p: hashes[p][2] for p in stats}
+
+    def prepare(self, mode='minimal', digest=False):
+        ignore = IgnoreRules.load(self.target_dir)
+        sources = self.get_sources(self.dockerfile_path) if mode == 'minimal' else None
+        self.files = self.select_files(sources if sources is not None else ['.'], ignore)
+        stats = {os.path.join(self.target_dir, f): os.stat(os.path.join(self.target_dir, f)) for f in self.files}
+        self.size = sum(st.st_size for st in stats.values())
+        if digest:
+            file_hashes = self.hash_files(stats)
+            context_digest = hashlib.sha256()
+            for rel_path in self.files:
+                context_digest.update(f'{rel_path}\n{file_hashes[os.path.join(self.target_dir, rel_path)]}\n'.encode())
+            self.digest = context_digest.hexdigest()
+        if sources is not None and '.' not in sources:
+            self.path = self.link(self.files)
+        return self
+
+    def link(self, files):
+        context_dir = os.path.join(contexts_dir, self.canonic_name)
+        shutil.rmtree(context_dir, ignore_errors=True)
+        for rel_path in files:
+            dst = os.path.join(context_dir, rel_path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.link(os.path.join(self.target_dir, rel_path), dst)
+            except OSError:
+                shutil.copy2(os.path.join(self.target_dir, rel_path), dst)
+        os.makedirs(context_dir, exist_ok=True)
+        return context_dir
+
+    def report(self, warn_mb=None):
+        size_mb = self.size / 1024 ** 2
+        print(print_green('Build context ') + f'{len(self.files)} files, {size_mb:.1f}MB' +
+              ('' if self.path == self.target_dir else f' linked into {self.path}'))
+        if warn_mb and size_mb > warn_mb:
+            print(print_yellow(f'Build context of {self.canonic_name} is {size_mb:.1f}MB, over {warn_mb}MB'))
@@ -0,0 +1,95 @@
+import os
+import json
+import fnmatch
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+hub_dir = os.path.join(root_dir, 'hub', 'hub')
+index_path = os.path.join(root_dir, '.cache', 'discovery-index.json')
+
+
+class HubDiscovery:
+    """Streams the target files of the hub on demand.
+
+    Ignored directories (``jina`` copies anywhere, ``.github`` and ``builder`` at the top) are pruned instead
+    of being listed and subtracted afterwards. With ``use_index`` the listing of every directory is cached
+    together with its mtime, so an unchanged directory is only stat-ed, never listed again.
+    """
+
+    patterns = ('*.y*ml', '*Dockerfile', '*.py')
+    ignore_dirs = {'jina'}
+    ignore_top_dirs = {'.github', 'builder'}
+
+    def __init__(self, path=hub_dir, use_index=False):
+        self.path = path
+        self.use_index = use_index
+        self.index = self.load_index() if use_index else {}
+        self.index_changed = False
+
+    def load_index(self):
+        if os.path.isfile(index_path):
+            with open(index_path) as fp:
+                try:
+                    index = json.load(fp)
+                except ValueError:
+                    return {}
+            if index.get('root') == self.path:
+                return index.get('dirs', {})
+        return {}
+
+    def save_index(self):
+        if not self.use_index or not self.index_changed:
+            return
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path + '.tmp', 'w') as fp:
+            json.dump({'root': self.path, 'dirs': self.index}, fp)
+        os.replace(index_path + '.tmp', index_path)
+        self.index_changed = False
+
+    def list_dir(self, dir_path):
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return [], []
+        cached = self.index.get(dir_path)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        files, dirs = [], []
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif any(fnmatch.fnmatch(entry.name, p) for p in self.patterns):
+                    files.append(entry.name)
+        files.sort()
+        dirs.sort()
+        if self.use_index:
+            self.index[dir_path] = [mtime, files, dirs]
+            self.index_changed = True
+        return files, dirs
+
+    def iter_files(self):
+        stack = [self.path]
+        visited = set()
+        while stack:
+            dir_path = stack.pop()
+            visited.add(dir_path)
+            files, dirs = self.list_dir(dir_path)
+            for file_name in files:
+                yield os.path.join(dir_path, file_name)
+            for dir_name in reversed(dirs):
+                if dir_name in self.ignore_dirs or dir_path == self.path and dir_name in self.ignore_top_dirs:
+                    continue
+                stack.append(os.path.join(dir_path, dir_name))
+        if self.use_index and set(self.index) - visited:
+            # forget directories that are gone or ignored now
+            self.index = {k: v for k, v in self.index.items() if k in visited}
+            self.index_changed = True
+        self.save_index()
+
+    def iter_targets(self):
+        seen = set()
+        for file_path in self.iter_files():
+            target = os.path.dirname(file_path)
+            if target not in seen:
+                seen.add(target)
+                yield target
@@ -0,0 +1,57 @@
+import os
+import fnmatch
+import hashlib
+
+from builder.modules.source import JinaSource
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Fingerprint:
+    """Content fingerprint of everything that goes into a target image.
+
+    A fingerprint covers the target's manifest, Dockerfile and sources, the builder inputs and the jina
+    source revision. Two builds with equal fingerprints produce the same image, whatever git says about
+    commit times.
+    """
+
+    patterns = ('*.yml', '*.yaml', '*Dockerfile', '*.py')
+    ignore_dirs = {'jina', '__pycache__', '.git'}
+
+    def __init__(self, builder_files):
+        self.builder_files = sorted(str(f) for f in builder_files)
+        self.jina_revision = JinaSource.get_revision()
+        self.common = self.get_common_digest()
+        self.cache = {}
+
+    def get_common_digest(self):
+        digest = hashlib.sha256()
+        digest.update(f'jina:{self.jina_revision}\n'.encode())
+        for file_path in self.builder_files:
+            self.update_with_file(digest, os.path.relpath(file_path, root_dir), file_path)
+        return digest.hexdigest()
+
+    @staticmethod
+    def update_with_file(digest, name, file_path):
+        digest.update(f'{name}\n'.encode())
+        with open(file_path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 16), b''):
+                digest.update(chunk)
+        digest.update(b'\n')
+
+    def get_target_files(self, target_dir):
+        for dir_path, dir_names, file_names in os.walk(target_dir):
+            dir_names[:] = sorted(d for d in dir_names if d not in self.ignore_dirs)
+            for file_name in sorted(file_names):
+                if any(fnmatch.fnmatch(file_name, p) for p in self.patterns):
+                    yield os.path.join(dir_path, file_name)
+
+    def get(self, target_dir):
+        target_dir = os.path.abspath(target_dir)
+        if target_dir not in self.cache:
+            digest = hashlib.sha256()
+            digest.update(f'builder:{self.common}\n'.encode())
+            for file_path in self.get_target_files(target_dir):
+                self.update_with_file(digest, os.path.relpath(file_path, target_dir), file_path)
+            self.cache[target_dir] = digest.hexdigest()
+        return self.cache[target_dir]
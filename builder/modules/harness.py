@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import uuid
+import signal
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from builder.modules.log import BuildLog
+from builder.color_print import *
+
+flow_check_code = '''
+import sys
+from jina.flow import Flow
+with Flow().add(image=sys.argv[1], replicas=3).build():
+    pass
+'''
+
+
+class ImageTestHarness:
+    """Runs the independent image checks concurrently, each under a hard deadline.
+
+    A check that outlives its timeout is killed together with its process group, and every container
+    started from the image is removed once all checks are over, so a hung image never blocks the queue.
+    """
+
+    def __init__(self, full_image_name, timeout=300, log=None):
+        self.full_image_name = full_image_name
+        self.timeout = timeout
+        self.log = log or BuildLog()
+        self.container_name = f'hub-test-{uuid.uuid4().hex[:12]}'
+
+    def get_checks(self):
+        return {
+            'docker run': ['docker', 'run', '--rm', '--name', self.container_name, self.full_image_name,
+                           '--max-idle-time', '5', '--shutdown-idle'],
+            'jina pod': ['jina', 'pod', '--image', self.full_image_name, '--max-idle-time', '5', '--shutdown-idle'],
+            'jina flow': [sys.executable, '-c', flow_check_code, self.full_image_name],
+        }
+
+    def run_check(self, name, cmd):
+        print(print_green(f'Testing {name} for image ') + self.full_image_name)
+        start = time.time()
+        timed_out = False
+        try:
+            returncode = self.log.run(f'test {name}', cmd, check=False, timeout=self.timeout, kill=self.kill,
+                                      start_new_session=True)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            returncode = None
+        result = {
+            'Status': returncode == 0,
+            'Duration': round(time.time() - start, 2),
+        }
+        if timed_out:
+            result['TimedOut'] = True
+            print(print_red(f'Test {name} timed out after {self.timeout}s for image ') + self.full_image_name)
+        elif returncode:
+            print(print_red(f'Test {name} failed with exit code {returncode} for image ') + self.full_image_name)
+        return name, result
+
+    @staticmethod
+    def kill(proc):
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        except ProcessLookupError:
+            pass
+
+    def clean_containers(self):
+        r = subprocess.run(['docker', 'ps', '-aq', '--filter', f'ancestor={self.full_image_name}'],
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        containers = r.stdout.decode().split()
+        if containers:
+            subprocess.call(['docker', 'rm', '-f'] + containers, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def run(self):
+        checks = self.get_checks()
+        with ThreadPoolExecutor(max_workers=len(checks)) as pool:
+            report = dict(pool.map(lambda item: self.run_check(*item), checks.items()))
+        if any(r.get('TimedOut') for r in report.values()):
+            self.clean_containers()
+        return report
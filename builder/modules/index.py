@@ -0,0 +1,119 @@
+import os
+import json
+import subprocess
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+cache_dir = os.path.join(root_dir, '.cache')
+
+
+class GitIndex:
+    """Maps every path of a git repo to its last-commit timestamp.
+
+    The index is built from a single ``git log --name-only`` pass and cached on disk against HEAD,
+    so an unchanged checkout never walks the history twice.
+    """
+
+    def __init__(self, repo_dir):
+        self.toplevel = self.get_toplevel(repo_dir)
+        self.head = self.get_head(self.toplevel) if self.toplevel else None
+        self.times = self.load() if self.head else {}
+
+    @staticmethod
+    def get_toplevel(repo_dir):
+        try:
+            r = subprocess.check_output(['git', '-C', str(repo_dir), 'rev-parse', '--show-toplevel'],
+                                        stderr=subprocess.DEVNULL)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return None
+        return os.path.realpath(r.strip().decode())
+
+    @staticmethod
+    def get_head(toplevel):
+        try:
+            r = subprocess.check_output(['git', '-C', toplevel, 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            return None
+        return r.strip().decode()
+
+    @property
+    def cache_path(self):
+        name = self.toplevel.strip(os.sep).replace(os.sep, '.') or 'root'
+        return os.path.join(cache_dir, f'git-index.{name}.json')
+
+    def load(self):
+        if os.path.isfile(self.cache_path):
+            with open(self.cache_path) as fp:
+                try:
+                    cached = json.load(fp)
+                except ValueError:
+                    cached = {}
+            if cached.get('head') == self.head:
+                return cached['times']
+        times = self.walk()
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(self.cache_path + '.tmp', 'w') as fp:
+            json.dump({'head': self.head, 'times': times}, fp)
+        os.replace(self.cache_path + '.tmp', self.cache_path)
+        return times
+
+    def walk(self):
+        # commits come newest first, so the first time a path shows up is its last-commit time
+        times = {}
+        stamp = 0
+        cmd = ['git', '-C', self.toplevel, '-c', 'core.quotepath=off',
+               'log', '--name-only', '--pretty=format:%x00%at', 'HEAD']
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+            for line in proc.stdout:
+                line = line.rstrip(b'\n').decode(errors='surrogateescape')
+                if not line:
+                    continue
+                if line.startswith('\x00'):
+                    stamp = int(line[1:])
+                elif line not in times:
+                    times[line] = stamp
+        return times
+
+    def relative(self, path):
+        if self.toplevel and path.startswith(self.toplevel + os.sep):
+            return path[len(self.toplevel) + 1:].replace(os.sep, '/')
+
+    def get(self, file_path):
+        rel_path = self.relative(os.path.realpath(str(file_path)))
+        return self.times.get(rel_path, 0) if rel_path is not None else 0
+
+
+class RepoIndex:
+    """Dispatches timestamp lookups to the innermost git repo holding the path."""
+
+    def __init__(self, *repo_dirs):
+        self.indexes = []
+        # absolute prefixes mapped to their repo, resolving symlinks only for paths matching none of them
+        self.prefixes = []
+        for repo_dir in repo_dirs:
+            if not os.path.isdir(repo_dir):
+                continue
+            index = GitIndex(repo_dir)
+            if not index.toplevel:
+                continue
+            if index.toplevel not in (i.toplevel for i in self.indexes):
+                self.indexes.append(index)
+                self.prefixes.append((index.toplevel, index))
+            else:
+                index = next(i for i in self.indexes if i.toplevel == index.toplevel)
+            alias = os.path.abspath(repo_dir)
+            if os.path.realpath(alias) == index.toplevel and alias != index.toplevel:
+                self.prefixes.append((alias, index))
+        self.prefixes.sort(key=lambda p: len(p[0]), reverse=True)
+
+    def get_modified_time(self, file_path) -> int:
+        path = os.path.abspath(str(file_path))
+        for prefix, index in self.prefixes:
+            if path.startswith(prefix + os.sep):
+                return index.times.get(path[len(prefix) + 1:].replace(os.sep, '/'), 0)
+        real_path = os.path.realpath(path)
+        if real_path != path:
+            for index in sorted(self.indexes, key=lambda i: len(i.toplevel), reverse=True):
+                rel_path = index.relative(real_path)
+                if rel_path is not None:
+                    return index.times.get(rel_path, 0)
+        return 0
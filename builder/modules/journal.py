@@ -0,0 +1,60 @@
+import os
+import json
+import time
+
+from builder.color_print import *
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+journal_dir = os.path.join(root_dir, '.cache', 'journal')
+
+
+class Journal:
+    """Crash-safe record of the images a run has already built.
+
+    After every target the image maps touched so far are written to ``.cache/journal/<run id>.json`` through
+    a temporary file and an atomic rename, so a killed run leaves either the previous or the new checkpoint
+    on disk, never a torn one. A resumed run with the same id restores them and skips those targets.
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.path = os.path.join(journal_dir, f'{run_id}.json')
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path) as fp:
+            try:
+                return json.load(fp)
+            except ValueError:
+                print(print_red('Broken journal ') + self.path + ', ignoring it')
+                return None
+
+    def checkpoint(self, history, names):
+        journal = {
+            'RunId': self.run_id,
+            'UpdatedAt': int(time.time()),
+            'LastBuildReason': history.get('LastBuildReason'),
+            'Images': {name: history['Images'][name] for name in sorted(names)},
+        }
+        os.makedirs(journal_dir, exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(journal, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.path)
+
+    def restore(self):
+        """Image maps completed by an earlier attempt of this run."""
+        journal = self.load()
+        if not journal:
+            print(print_yellow('Nothing to resume for run ') + self.run_id)
+            return {}
+        images = journal.get('Images', {})
+        print(print_green(f'Resuming run {self.run_id}, {len(images)} targets already done'))
+        return images
+
+    def discard(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -2,42 +2,179 @@ import os
 import json
 
 import datetime
-import re
-import requests
+import threading
 import subprocess
 
-from pymongo import MongoClient
-from ruamel.yaml import YAML
+from builder.modules.badge import BadgeRenderer
 from builder.color_print import *
-yaml = YAML()
 
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 package_path = os.path.join(root_dir, 'api', 'hub', 'package')
 status_path = os.path.join(root_dir, 'api', 'hub', 'status')
+badge_dir = os.path.join(root_dir, 'status', 'badges')
+build_badge_start = '<!-- START_BUILD_BADGE -->'
+build_badge_end = '<!-- END_BUILD_BADGE -->'
+
+
+summary_fields = ('ImageName', 'ImageStatus', 'LastBuildTime', 'LastBuildDuration', 'Fingerprint',
+                  'LastGoodFingerprint')
+
+
+def get_image_summary(history, name):
+    """Image entry as loaded, without fetching the full document from the database."""
+    return dict.get(history['Images'], name, {})
+
+
+class ImageHistory(dict):
+    """Image entries of the history, holding only summary fields until an entry is actually read.
+
+    Full entries are fetched by ``fetch(names) -> {name: entry}`` on first access, and all at once by
+    ``materialize`` when the complete history has to be written out.
+    """
+
+    def __init__(self, summaries, fetch):
+        super().__init__(summaries)
+        self.partial = set(summaries)
+        self.fetch = fetch
+        self.lock = threading.Lock()
+
+    def load(self, names):
+        with self.lock:
+            names = [name for name in names if name in self.partial]
+            if names:
+                for name, entry in self.fetch(names).items():
+                    dict.__setitem__(self, name, entry)
+                self.partial.difference_update(names)
+
+    def __getitem__(self, name):
+        self.load([name])
+        return dict.__getitem__(self, name)
+
+    def get(self, name, default=None):
+        self.load([name])
+        return dict.get(self, name, default)
+
+    def __setitem__(self, name, value):
+        with self.lock:
+            self.partial.discard(name)
+            dict.__setitem__(self, name, value)
+
+    def materialize(self):
+        self.load(list(self.partial))
+        return dict(self)
 
 
 class Mongo:
 
-    def __init__(self):
+    clients = {}
+
+    def __init__(self, connect=True):
         credentials = os.getenv('MONGODB_CREDENTIALS')
-        if credentials:
+        self.migrate = False
+        self.indexed = False
+        if not connect:
+            self.db = None
+        elif credentials:
             address = f"mongodb+srv://{credentials}@cluster0-irout.mongodb.net/test?retryWrites=true&w=majority"
-            client = MongoClient(address)
-            self.db = client['jina-test']
+            self.db = self.get_client(address)['jina-test']
         else:
             self.db = None
             print(f'Incorrect credentials "{credentials}" for DB connection. Will use status.json as history source.')
 
-    def update_history_on_db(self, **kwargs):
-        if self.db:
-            spec = {'_id': 1}
-            self.db.docker.replace_one(filter=spec, replacement=dict(**kwargs), upsert=True)
-            print(print_green('Hub history updated successfully on database'))
+    @classmethod
+    def get_client(cls, address):
+        # MongoClient keeps its own connection pool, one client per address is enough
+        if address not in cls.clients:
+            # imported here so runs without a database never pay for pymongo
+            from pymongo import MongoClient
+            cls.clients[address] = MongoClient(address)
+        return cls.clients[address]
 
-    def get_history_from_database(self):
-        if self.db:
-            spec = {'_id': 1}
-            return self.db.docker.find_one(filter=spec)
+    def update_history_on_db(self, history, images=None):
+        """Upsert one document per touched image, its build event, and the run status document."""
+        if self.db is None:
+            return
+        from pymongo import ReplaceOne, DeleteMany
+        all_images = history['Images']
+        if images is None or self.migrate:
+            images = list(all_images.keys())
+        if isinstance(all_images, ImageHistory):
+            all_images.load(images)
+        image_ops = []
+        build_ops = []
+        for name in images:
+            image = all_images[name]
+            entry = {k: v for k, v in image.items() if k != 'ImageBuilds'}
+            image_ops.append(ReplaceOne({'_id': name}, dict(entry, _id=name), upsert=True))
+            if self.migrate:
+                # the single document held the whole build log, every build of it becomes an event
+                durations = image.get('ImageBuildDurations') or {}
+                for stamp, status in (image.get('ImageBuilds') or {}).items():
+                    build_ops.append(self.get_build_op(name, int(stamp), status, durations.get(stamp)))
+            if 'LastBuildTime' in entry:
+                build_ops.append(self.get_build_op(name, entry['LastBuildTime'], entry.get('ImageStatus'),
+                                                   entry.get('LastBuildDuration')))
+            retained = [int(stamp) for stamp in image.get('ImageBuilds') or {}]
+            if retained:
+                # builds the retention rolled into ImageBuildStats must not come back as events on the next load
+                build_ops.append(DeleteMany({'ImageName': name, 'Timestamp': {'$lt': min(retained)}}))
+        if not self.indexed:
+            self.db.builds.create_index([('ImageName', 1), ('Timestamp', 1)])
+            self.indexed = True
+        if image_ops:
+            self.db.images.bulk_write(image_ops, ordered=False)
+        if build_ops:
+            self.db.builds.bulk_write(build_ops, ordered=False)
+        status = {k: v for k, v in history.items() if k not in ('Images', '_id')}
+        self.db.status.replace_one(filter={'_id': 1}, replacement=status, upsert=True)
+        self.migrate = False
+        print(print_green(f'Hub history updated successfully on database ({len(image_ops)} images)'))
+
+    @staticmethod
+    def get_build_op(name, timestamp, status, duration=None):
+        from pymongo import UpdateOne
+        return UpdateOne({'_id': f'{name}:{timestamp}'}, {'$set': {
+            'ImageName': name,
+            'Timestamp': timestamp,
+            'ImageStatus': status,
+            'LastBuildDuration': duration,
+        }}, upsert=True)
+
+    def get_history_from_database(self, fallback_images=None):
+        if self.db is None:
+            return
+        history = self.db.status.find_one(filter={'_id': 1})
+        if history is None:
+            # history written in the single document layout, rewrite it per image on the next update
+            history = self.db.docker.find_one(filter={'_id': 1})
+            self.migrate = history is not None
+            return history
+        projection = {field: True for field in summary_fields}
+        summaries = {doc['_id']: {k: v for k, v in doc.items() if k != '_id'}
+                     for doc in self.db.images.find({}, projection)}
+        history['Images'] = ImageHistory(summaries, lambda names: self.get_images_from_database(names,
+                                                                                                fallback_images))
+        return history
+
+    def get_images_from_database(self, names, fallback_images=None):
+        fallback_images = fallback_images or {}
+        images = {}
+        for doc in self.db.images.find({'_id': {'$in': list(names)}}):
+            images[doc.pop('_id')] = doc
+        builds = self.get_builds([name for name in images if not fallback_images.get(name, {}).get('ImageBuilds')])
+        for name, doc in images.items():
+            doc['ImageBuilds'] = fallback_images.get(name, {}).get('ImageBuilds') or builds.get(name, {})
+        return images
+
+    def get_builds(self, names):
+        """Build log of every image in ``names``, read with a single query."""
+        builds = {}
+        if not names:
+            return builds
+        projection = {'ImageName': True, 'Timestamp': True, 'ImageStatus': True}
+        for b in self.db.builds.find({'ImageName': {'$in': list(names)}}, projection):
+            builds.setdefault(b['ImageName'], {})[str(b['Timestamp'])] = b['ImageStatus']
+        return builds
 
     # def select_head(self, n):
     #     return dict(self.db.docker.find().limit(n))
@@ -48,12 +185,12 @@ class Mongo:
 
 class StateLoader(Mongo):
 
-    def __init__(self):
-        Mongo.__init__(self)
+    def __init__(self, connect=True):
+        Mongo.__init__(self, connect)
 
     def get_history(self):
         local_history = self.get_local_history()
-        remote_history = self.get_history_from_database()
+        remote_history = self.get_history_from_database(fallback_images=(local_history or {}).get('Images'))
         empty_history = {'Images': {}, 'LastBuildTime': {}, 'LastBuildStatus': {}, 'LastBuildReason': ''}
         history = remote_history or local_history or empty_history
         if history == empty_history:
@@ -69,74 +206,88 @@ class StateLoader(Mongo):
                 history['Images'] = json.load(bp)
             return history
 
-    def update_total_history(self, history):
-        self.update_readme(history)
+    def update_total_history(self, history, images=None):
+        self.update_readme(history, images)
         self.update_hub_badge(history)
-        self.update_history_on_db(**history)
-        self.update_api(history)
+        self.update_history_on_db(history, images)
+        self.update_api(history, images)
 
-    def update_readme(self, history):
+    def update_readme(self, history, images=None):
         readme_path = os.path.join(root_dir, 'status', 'README.md')
-        build_badge_regex = r'<!-- START_BUILD_BADGE -->(.*)<!-- END_BUILD_BADGE -->'
-        build_badge_prefix = r'<!-- START_BUILD_BADGE --><!-- END_BUILD_BADGE -->'
         with open(readme_path, 'r') as fp:
             tmp = fp.read()
+        start = tmp.find(build_badge_start)
+        end = tmp.find(build_badge_end, start)
+        if start < 0 or end < 0:
+            print(print_red('Build badge markers not found in ') + str(readme_path))
+            return
+        self.update_status_badges(history['LastBuildStatus'], images)
 
-            badge_str = '\n'.join([self.get_badge_md(k, v) for k, v in history['LastBuildStatus'].items()])
-            h1 = f'## Last Build at: {datetime.datetime.now():%Y-%m-%d %H:%M:%S %Z}'
-            h2 = '<summary>Reason</summary>'
-            h3 = '**Images**'
-            reason = '\n\n'.join(history['LastBuildReason'])
-            content = [build_badge_prefix, h1, h3, badge_str, '<details>', h2, reason, '</details>']
-            tmp = re.sub(pattern=build_badge_regex, repl='\n\n'.join(content), string=tmp, flags=re.DOTALL)
+        # badge files carry the status, so the line of an image stays the same whatever its status is
+        badge_str = '\n'.join([self.get_badge_md(k) for k in history['LastBuildStatus']])
+        h1 = f'## Last Build at: {datetime.datetime.now():%Y-%m-%d %H:%M:%S %Z}'
+        h2 = '<summary>Reason</summary>'
+        h3 = '**Images**'
+        reason = history['LastBuildReason']
+        reason = '\n\n'.join([reason] if isinstance(reason, str) else reason or [])
+        content = [h1, h3, badge_str, '<details>', h2, reason, '</details>']
+        tmp = tmp[:start + len(build_badge_start)] + '\n\n' + '\n\n'.join(content) + '\n\n' + tmp[end:]
         with open(readme_path, 'w') as fp:
             fp.write(tmp)
             print(print_green('Hub readme updated successfully on path ') + str(readme_path))
 
     @staticmethod
-    def get_badge_md(img_name, status):
-        safe_url_name = img_name.replace('-', '--').replace('_', '__').replace(' ', '_')
-        if status is True:
-            success_tag = 'success-success'
-        elif status is False:
-            success_tag = 'fail-critical'
-        else:
-            success_tag = 'pending-yellow'
-        return f'[![{img_name}](https://img.shields.io/badge/{safe_url_name}-' \
-               f'{success_tag}?style=flat-square)]' \
+    def update_status_badges(statuses, images=None):
+        """Render the badge of every image whose status may have changed, or that has none yet."""
+        written = 0
+        for name, status in statuses.items():
+            badge_path = os.path.join(badge_dir, f'{name}.svg')
+            if images is None or name in images or not os.path.isfile(badge_path):
+                written += BadgeRenderer.write(badge_path, BadgeRenderer.render_status(name, status))
+        print(print_green(f'{written} status badges updated on path ') + str(badge_dir))
+
+    @staticmethod
+    def get_badge_md(img_name):
+        return f'[![{img_name}](badges/{img_name}.svg)]' \
                f'(https://hub.docker.com/repository/docker/jinaai/{img_name})'
 
-    def update_api(self, history):
-        self.update_build_json(history)
+    def update_api(self, history, images=None):
+        self.update_build_json(history, images)
         self.update_status_json(history)
 
     @staticmethod
-    def update_build_json(history):
-        images = history.pop('Images')
-        with open(package_path, 'w') as fp:
-            json.dump(images, fp)
-        with open(package_path + '.json', 'w') as fp:
-            json.dump(images, fp)
+    def write_api_file(path, data):
+        content = json.dumps(data)
+        for file_path in (path, path + '.json'):
+            with open(file_path, 'w') as fp:
+                fp.write(content)
+
+    @staticmethod
+    def update_build_json(history, images=None):
+        all_images = history['Images']
+        if isinstance(all_images, ImageHistory) and images is not None and os.path.isfile(package_path):
+            # the published package already holds every image this run did not touch, don't fetch them all
+            with open(package_path) as fp:
+                package = json.load(fp)
+            all_images.load(list(images))
+            for name in images:
+                package[name] = all_images[name]
+        elif isinstance(all_images, ImageHistory):
+            package = all_images.materialize()
+        else:
+            package = all_images
+        StateLoader.write_api_file(package_path, package)
         print(print_green(f'Package api updated on path ') + str(package_path))
 
     @staticmethod
     def update_status_json(history):
-        if '_id' in history:
-            history.pop('_id')
-        with open(status_path, 'w') as fp:
-            json.dump(history, fp)
-        with open(status_path + '.json', 'w') as fp:
-            json.dump(history, fp)
+        status = {k: v for k, v in history.items() if k not in ('Images', '_id')}
+        StateLoader.write_api_file(status_path, status)
         print(print_green('Status api updated on path ') + str(status_path))
 
     @staticmethod
     def update_hub_badge(history):
         hubbadge_path = os.path.join(root_dir, 'status', 'hub-stat.svg')
-        url = f'https://badgen.net/badge/Hub%20Images/{len(history["Images"])}/cyan'
-        response = requests.get(url)
-        if response.ok:
-            with open(hubbadge_path, 'wb') as opfile:
-                opfile.write(response.content)
+        svg = BadgeRenderer.render('Hub Images', str(len(history['Images'])), '#1bc')
+        if BadgeRenderer.write(hubbadge_path, svg):
             print(print_green('Hub badge updated successfully on path ') + str(hubbadge_path))
-        else:
-            print(print_red('Hub badge update failed ') + str(hubbadge_path))
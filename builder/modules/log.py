@@ -0,0 +1,108 @@
+import os
+import re
+import sys
+import gzip
+import shlex
+import threading
+import subprocess
+from collections import deque
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+log_dir = os.path.join(root_dir, '.cache', 'logs')
+
+
+secret_regex = re.compile(r'^(?P<key>[\w.-]*(PASSWORD|PWD|TOKEN|SECRET)[\w.-]*=).+$', flags=re.IGNORECASE)
+
+
+class BuildLog:
+    """Streams the output of the subprocesses of one target build into a gzip file.
+
+    A reader thread drains every subprocess as it writes, so a chatty build never blocks on a full pipe,
+    and keeps only the last ``tail`` lines of each step in a ring buffer. Lines are read in bounded chunks,
+    so memory stays the same however verbose a build is. The tail of every failing step is kept in
+    ``failures`` for the image history. Without a path the output only goes to the console.
+    """
+
+    max_line = 8192
+
+    def __init__(self, path=None, tail=50, echo=True):
+        self.path = path
+        self.tail = tail
+        self.echo = echo
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.file = None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = gzip.open(path, 'wb')
+
+    def write(self, data, echo=True):
+        with self.lock:
+            if self.file:
+                self.file.write(data)
+            if self.echo and echo:
+                sys.stdout.write(data.decode(errors='replace'))
+                sys.stdout.flush()
+
+    def pump(self, step, stream, ring):
+        # steps of one target may run side by side, every line says which one it belongs to
+        prefix = f'[{step}] '.encode()
+        for line in iter(lambda: stream.readline(self.max_line), b''):
+            ring.append(line)
+            self.write(prefix + line)
+        stream.close()
+
+    def run(self, step, cmd, check=True, timeout=None, kill=None, **popen_kwargs):
+        """Run ``cmd`` with its output logged, returns the exit code.
+
+        A non-zero exit raises ``CalledProcessError`` when ``check`` is set. Past ``timeout`` the process is
+        handed to ``kill`` and ``TimeoutExpired`` is raised; either way the tail of the step is kept.
+        """
+        self.write(f'[{step}] $ {self.format_cmd(cmd)}\n'.encode(), echo=False)
+        ring = deque(maxlen=self.tail)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **popen_kwargs)
+        reader = threading.Thread(target=self.pump, args=(step, proc.stdout, ring), daemon=True)
+        reader.start()
+        try:
+            returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            (kill or subprocess.Popen.kill)(proc)
+            proc.wait()
+            # a stray grandchild may still hold the pipe, don't wait on it forever
+            reader.join(timeout=10)
+            self.add_failure(step, None, ring, timed_out=True)
+            raise
+        reader.join()
+        if returncode:
+            self.add_failure(step, returncode, ring)
+            if check:
+                raise subprocess.CalledProcessError(returncode, cmd)
+        return returncode
+
+    @staticmethod
+    def format_cmd(cmd):
+        """Command line as logged, with the values of password and token arguments masked."""
+        return ' '.join(shlex.quote(secret_regex.sub(r'\g<key>***', str(c))) for c in cmd)
+
+    def add_failure(self, step, returncode, ring, timed_out=False):
+        failure = {
+            'ReturnCode': returncode,
+            'Tail': [line.decode(errors='replace').rstrip('\r\n') for line in ring],
+        }
+        if timed_out:
+            failure['TimedOut'] = True
+        with self.lock:
+            self.failures[step] = failure
+
+    def get_excerpt(self):
+        lines = []
+        for step, failure in self.failures.items():
+            lines.append(f'--- last {len(failure["Tail"])} lines of {step} ---')
+            lines += failure['Tail']
+        return '\n'.join(lines)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
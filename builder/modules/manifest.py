@@ -0,0 +1,82 @@
+import os
+import json
+import hashlib
+import threading
+import subprocess
+import unicodedata
+
+from ruamel.yaml import YAML
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+cache_dir = os.path.join(root_dir, '.cache', 'manifests')
+
+# bump when the normalization changes, so stale cache entries are never picked up
+cache_version = 1
+
+
+class ManifestLoader:
+    """Loads manifests with the safe loader and caches the normalized result on disk by content hash.
+
+    ruamel's safe loader goes through libyaml when ``ruamel.yaml.clib`` is installed. The revision that is
+    stamped into every manifest is resolved once per process instead of once per target.
+    """
+
+    lock = threading.Lock()
+    yaml = YAML(typ='safe')
+    revision = None
+
+    @classmethod
+    def get_revision(cls):
+        with cls.lock:
+            if cls.revision is None:
+                cls.revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).strip().decode()
+            return cls.revision
+
+    @staticmethod
+    def remove_control_characters(source):
+        if not isinstance(source, str) or source.isprintable():
+            return source
+        return ''.join(ch for ch in source if not unicodedata.category(ch).startswith('C'))
+
+    @classmethod
+    def normalize(cls, manifest):
+        """Strip control characters from every string value, returns the manifest and the changed keys."""
+        changed = {}
+        for key, value in manifest.items():
+            if isinstance(value, list):
+                updated_value = [cls.remove_control_characters(v) for v in value]
+            else:
+                updated_value = cls.remove_control_characters(value)
+            if updated_value != value:
+                manifest[key] = updated_value
+                changed[key] = value
+        return manifest, changed
+
+    @classmethod
+    def get_cache_path(cls, content):
+        digest = hashlib.sha256(f'v{cache_version}\n'.encode() + content).hexdigest()
+        return os.path.join(cache_dir, digest[:2], f'{digest}.json')
+
+    @classmethod
+    def load(cls, manifest_path):
+        with open(manifest_path, 'rb') as fp:
+            content = fp.read()
+        cache_path = cls.get_cache_path(content)
+        if os.path.isfile(cache_path):
+            try:
+                with open(cache_path) as fp:
+                    cached = json.load(fp)
+                return cached['manifest'], cached['changed']
+            except (ValueError, KeyError):
+                pass
+        with cls.lock:
+            manifest = cls.yaml.load(content) or {}
+        manifest, changed = cls.normalize(dict(manifest))
+        # go through json on a miss as well, so a hit and a miss hand out exactly the same values
+        cached = json.loads(json.dumps({'manifest': manifest, 'changed': changed}, default=str))
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(cached, fp)
+        os.replace(tmp_path, cache_path)
+        return cached['manifest'], cached['changed']
@@ -0,0 +1,118 @@
+import re
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from builder.color_print import *
+
+
+class BuildPlan:
+    """Orders targets by the base images their Dockerfiles build ``FROM``.
+
+    Targets sharing a base are scheduled next to each other so the base and its layers are hot in the cache,
+    and every distinct base is pulled once up front instead of once per target.
+    """
+
+    from_regex = r'^\s*FROM\s+(?:--platform=\S+\s+)?(?P<image>\S+)(?:\s+AS\s+(?P<stage>\S+))?\s*$'
+    arg_regex = r'^\s*ARG\s+(?P<name>\w+)(?:=(?P<value>\S*))?\s*$'
+
+    def __init__(self, targets):
+        self.targets = list(targets)
+        self.bases = {t.canonic_name: self.get_base_images(t.dockerfile_path) for t in self.targets}
+
+    @classmethod
+    def get_base_images(cls, dockerfile_path):
+        """External images of a Dockerfile, the base of its final stage first."""
+        global_args = {}
+        stages = {}
+        bases = []
+        try:
+            with open(dockerfile_path) as dockerfile:
+                lines = dockerfile.readlines()
+        except OSError:
+            return []
+        for line in lines:
+            arg = re.match(cls.arg_regex, line, flags=re.IGNORECASE)
+            if arg and not bases and arg.group('value') is not None:
+                global_args[arg.group('name')] = arg.group('value').strip('"\'')
+                continue
+            m = re.match(cls.from_regex, line, flags=re.IGNORECASE)
+            if not m:
+                continue
+            image = re.sub(r'\$\{?(\w+)\}?', lambda a: global_args.get(a.group(1), a.group(0)), m.group('image'))
+            # a stage built on an earlier stage inherits that stage's base
+            image = stages.get(image.lower(), image)
+            if m.group('stage'):
+                stages[m.group('stage').lower()] = image
+            bases.append(image)
+        external = []
+        for image in reversed(bases):
+            if image != 'scratch' and '$' not in image and image not in external:
+                external.append(image)
+        return external
+
+    def get_group_key(self, target):
+        bases = self.bases.get(target.canonic_name)
+        return bases[0] if bases else ''
+
+    def get_groups(self, targets=None):
+        groups = {}
+        for target in targets if targets is not None else self.targets:
+            groups.setdefault(self.get_group_key(target), []).append(target)
+        return groups
+
+    def order(self, targets, duration_fn):
+        """Longest group first, longest target first inside a group."""
+        groups = self.get_groups(targets)
+        for key in groups:
+            groups[key].sort(key=lambda t: (-duration_fn(t), t.canonic_name))
+        keys = sorted(groups, key=lambda k: (-sum(duration_fn(t) for t in groups[k]), k))
+        return [t for k in keys for t in groups[k]]
+
+    def get_distinct_bases(self):
+        return sorted({image for bases in self.bases.values() for image in bases})
+
+    @staticmethod
+    def get_builder_driver():
+        try:
+            r = subprocess.check_output(['docker', 'buildx', 'inspect'], stderr=subprocess.DEVNULL)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return None
+        for line in r.decode().splitlines():
+            key, _, value = line.partition(':')
+            if key.strip() == 'Driver':
+                return value.strip()
+        return None
+
+    @staticmethod
+    def pull_base(image):
+        r = subprocess.call(['docker', 'pull', '--quiet', image], stdout=subprocess.DEVNULL)
+        if r:
+            print(print_yellow('Can\'t pre-pull base image ') + image)
+        return r == 0
+
+    def pull_bases(self, jobs=4, cache=None):
+        bases = self.get_distinct_bases()
+        if not bases:
+            return
+        driver = self.get_builder_driver()
+        if driver not in (None, 'docker'):
+            # such a builder resolves bases in its own store and never reads the docker image store
+            print(print_green(f'Builder uses the {driver} driver, leaving {len(bases)} base images to it'))
+            return
+        print(print_green(f'Pre-pulling {len(bases)} distinct base images'))
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            pulled = [image for image, ok in zip(bases, pool.map(self.pull_base, bases)) if ok]
+        print(print_green(f'Pulled {len(pulled)}/{len(bases)} base images'))
+        if cache:
+            for image in pulled:
+                cache.add_base(image)
+
+    def print_plan(self, ordered):
+        print(print_green(f'Build plan for {len(ordered)} targets, {len(self.get_distinct_bases())} base images'))
+        current = None
+        for target in ordered:
+            key = self.get_group_key(target)
+            if key != current:
+                current = key
+                print(print_purple(f'FROM {key or "<unresolved>"}'))
+            print(f'  {target.canonic_name}')
@@ -0,0 +1,53 @@
+import os
+import contextlib
+
+from concurrent.futures import ProcessPoolExecutor
+from builder.modules.valid import Validator
+from builder.modules.target import Target
+from builder.color_print import *
+
+
+def validate_target(path):
+    try:
+        # manifests are echoed by Target, which is unreadable when the whole hub loads at once
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            Validator(Target(path))
+    except Exception as e:
+        return path, f'{type(e).__name__}: {e}'
+    return path, None
+
+
+class Preflight:
+    """Validates every selected target before any docker work starts.
+
+    Rule files are loaded once in the parent and inherited by the workers, manifests are loaded and checked
+    in a process pool, and all failures are reported together.
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        Validator.preload()
+
+    def run(self, paths):
+        paths = sorted(paths)
+        if not paths:
+            return [], {}
+        print(print_green(f'Validating {len(paths)} targets'))
+        if self.jobs == 1 or len(paths) == 1:
+            results = [validate_target(path) for path in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                results = list(pool.map(validate_target, paths, chunksize=max(1, len(paths) // (self.jobs * 4))))
+        valid = [path for path, error in results if error is None]
+        failures = {path: error for path, error in results if error is not None}
+        self.report(failures)
+        return valid, failures
+
+    @staticmethod
+    def report(failures):
+        if not failures:
+            print(print_green('All targets passed validation'))
+            return
+        print(print_red(f'{len(failures)} targets failed validation and are excluded from the build:'))
+        for path, error in sorted(failures.items()):
+            print(print_red(f'  {Target.get_canonic_name(path)}') + f': {error}')
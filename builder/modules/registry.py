@@ -0,0 +1,133 @@
+import os
+import re
+import threading
+
+from builder.color_print import *
+
+docker_hub_host = 'registry-1.docker.io'
+manifest_types = ', '.join([
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.oci.image.manifest.v1+json',
+])
+
+
+class RegistryClient:
+    """Asks a registry whether a tag exists with a manifest ``HEAD``, never pulling anything.
+
+    All lookups go through one pooled HTTP session, and bearer tokens are cached per repository, so checking
+    a whole hub costs one round trip per image. Docker Hub names (``jinaai/<image>``) go to Docker Hub, names
+    with a registry host (``localhost:5000/<image>``) to that host, over plain HTTP for a local one.
+    """
+
+    session = None
+    lock = threading.Lock()
+
+    def __init__(self, username=None, password=None):
+        self.auth = (username, password) if username and password else None
+        self.tokens = {}
+        self.digests = {}
+
+    @classmethod
+    def get_session(cls):
+        with cls.lock:
+            if cls.session is None:
+                # imported here so runs that never ask the registry never pay for requests
+                import requests
+                from requests.adapters import HTTPAdapter
+                cls.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+                cls.session.mount('https://', adapter)
+                cls.session.mount('http://', adapter)
+            return cls.session
+
+    @staticmethod
+    def is_docker_hub(image_name):
+        first = image_name.split('/', 1)[0]
+        return '/' not in image_name or not ('.' in first or ':' in first or first == 'localhost')
+
+    @classmethod
+    def parse_image_name(cls, image_name):
+        """Split ``[host/]repository[:tag]`` into the registry URL, the repository and the tag."""
+        name, _, tag = image_name.rpartition(':') if ':' in image_name.rsplit('/', 1)[-1] else (image_name, '', '')
+        if cls.is_docker_hub(name):
+            host, repository = docker_hub_host, name if '/' in name else f'library/{name}'
+        else:
+            host, repository = name.split('/', 1)
+        local = host.split(':', 1)[0] in ('localhost', '127.0.0.1')
+        return f'{"http" if local else "https"}://{host}', repository, tag or 'latest'
+
+    @staticmethod
+    def parse_challenge(header):
+        scheme, _, params = header.partition(' ')
+        if scheme.lower() != 'bearer':
+            return None
+        return dict(re.findall(r'(\w+)="([^"]*)"', params))
+
+    def get_token(self, repository, challenge):
+        if repository in self.tokens:
+            return self.tokens[repository]
+        params = {k: v for k, v in challenge.items() if k in ('service', 'scope')}
+        params.setdefault('scope', f'repository:{repository}:pull')
+        r = self.get_session().get(challenge['realm'], params=params, auth=self.auth, timeout=30)
+        r.raise_for_status()
+        body = r.json()
+        self.tokens[repository] = body.get('token') or body.get('access_token')
+        return self.tokens[repository]
+
+    def head_manifest(self, image_name):
+        url, repository, tag = self.parse_image_name(image_name)
+        manifest_url = f'{url}/v2/{repository}/manifests/{tag}'
+        headers = {'Accept': manifest_types}
+        if repository in self.tokens:
+            headers['Authorization'] = f'Bearer {self.tokens[repository]}'
+        session = self.get_session()
+        r = session.head(manifest_url, headers=headers, timeout=30)
+        if r.status_code == 401:
+            challenge = self.parse_challenge(r.headers.get('WWW-Authenticate', ''))
+            if challenge is None:
+                if self.auth is None:
+                    r.raise_for_status()
+                r = session.head(manifest_url, headers=headers, auth=self.auth, timeout=30)
+            else:
+                self.tokens.pop(repository, None)
+                headers['Authorization'] = f'Bearer {self.get_token(repository, challenge)}'
+                r = session.head(manifest_url, headers=headers, timeout=30)
+        return r
+
+    def has_manifest(self, image_name):
+        r = self.head_manifest(image_name)
+        if r.status_code == 404:
+            return False
+        r.raise_for_status()
+        return True
+
+    def get_digest(self, image_name):
+        """Digest of the manifest a tag points at, ``None`` when the registry doesn't know the tag."""
+        if '@' in image_name:
+            return image_name.rsplit('@', 1)[1]
+        with self.lock:
+            if image_name in self.digests:
+                return self.digests[image_name]
+        r = self.head_manifest(image_name)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        digest = r.headers.get('Docker-Content-Digest')
+        with self.lock:
+            # bases are shared by many targets, resolve each of them once per run
+            self.digests[image_name] = digest
+        return digest
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get('DOCKERHUB_DEVBOT_USER'), os.environ.get('DOCKERHUB_DEVBOT_PWD'))
+
+    def lookup(self, image_name):
+        """``has_manifest`` that reports a registry failure as a miss, so the image is just built."""
+        try:
+            return self.has_manifest(image_name)
+        except Exception as e:
+            print(print_yellow(f'Can\'t look up {image_name} in the registry: ') + str(e))
+            return False
@@ -0,0 +1,55 @@
+import time
+
+
+class BuildLogRetention:
+    """Keeps the build log of an image bounded.
+
+    The last ``keep`` raw entries of ``ImageBuilds`` (and their ``ImageBuildDurations``) stay as they are;
+    older ones are rolled into per-day or per-week counters under ``ImageBuildStats``, so the history of an
+    image stops growing with every nightly run.
+    """
+
+    periods = {
+        'daily': '%Y-%m-%d',
+        'weekly': '%G-W%V',
+    }
+
+    def __init__(self, keep=50, period='weekly'):
+        self.keep = max(0, keep)
+        self.period_format = self.periods[period]
+
+    def get_period(self, timestamp):
+        return time.strftime(self.period_format, time.gmtime(int(timestamp)))
+
+    def compact(self, image):
+        build_log = image.get('ImageBuilds') or {}
+        if len(build_log) <= self.keep:
+            return image
+        durations = image.get('ImageBuildDurations') or {}
+        stats = image.get('ImageBuildStats') or {}
+        stamps = sorted(build_log, key=int)
+        expired = stamps[:len(stamps) - self.keep]
+        for stamp in expired:
+            period = stats.setdefault(self.get_period(stamp),
+                                      {'Success': 0, 'Failure': 0, 'MeanDuration': None, 'Timed': 0})
+            period['Success' if build_log.pop(stamp) else 'Failure'] += 1
+            duration = durations.pop(stamp, None)
+            if duration is not None:
+                # running mean, so already rolled builds never need to be kept around
+                period['Timed'] += 1
+                mean = period['MeanDuration'] or 0
+                period['MeanDuration'] = round(mean + (duration - mean) / period['Timed'], 2)
+        image['ImageBuilds'] = build_log
+        image['ImageBuildDurations'] = durations
+        image['ImageBuildStats'] = dict(sorted(stats.items()))
+        return image
+
+    def compact_history(self, history):
+        compacted = 0
+        for name in list(history['Images'].keys()):
+            image = history['Images'][name]
+            size = len(image.get('ImageBuilds') or {})
+            self.compact(image)
+            if len(image.get('ImageBuilds') or {}) != size:
+                compacted += 1
+        return compacted
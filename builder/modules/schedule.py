@@ -0,0 +1,83 @@
+import copy
+import queue
+import threading
+
+from builder.modules.load import get_image_summary
+from builder.color_print import *
+
+
+class Scheduler:
+    """Runs target builds on a pool of worker threads.
+
+    Targets are fed through a bounded queue, longest ``LastBuildDuration`` first, so the slowest images start
+    early and do not dominate the tail of the run. With a ``BuildPlan``, targets are grouped by base image first.
+    Every worker builds against its own snapshot of the image history; the resulting image maps are handed back
+    to the calling thread, which is the only one that ever touches ``history``.
+    """
+
+    def __init__(self, build_fn, history, jobs=1, queue_size=None, plan=None, error_fn=None):
+        self.build_fn = build_fn
+        self.error_fn = error_fn
+        self.history = history
+        self.plan = plan
+        self.jobs = max(1, jobs or 1)
+        self.queue_size = queue_size or self.jobs * 2
+
+    def get_duration(self, target):
+        image = get_image_summary(self.history, target.canonic_name)
+        duration = image.get('LastBuildDuration')
+        # never built images have no estimate, start them first rather than risk a long tail
+        return float('inf') if duration is None else duration
+
+    def order(self, targets):
+        if self.plan:
+            return self.plan.order(targets, self.get_duration)
+        return sorted(targets, key=lambda t: (-self.get_duration(t), t.canonic_name))
+
+    def run(self, targets, on_done, ordered=False):
+        if not ordered:
+            targets = self.order(targets)
+        if not targets:
+            return
+        print(print_green(f'Scheduling {len(targets)} targets on {self.jobs} worker(s)'))
+        tasks = queue.Queue(maxsize=self.queue_size)
+        results = queue.Queue()
+
+        def work():
+            while True:
+                target = tasks.get()
+                if target is None:
+                    return
+                image = copy.deepcopy(self.history.get('Images', {}).get(target.canonic_name, {}))
+                try:
+                    image_map = self.build_fn(target, image)
+                except Exception as e:
+                    # a target must never vanish from history, record the failure when the caller can
+                    image_map = self.error_fn(target, image, e) if self.error_fn else None
+                    if image_map is None:
+                        print(print_red(e) + f' while scheduling {target.canonic_name}')
+                except BaseException as e:
+                    print(print_red(e) + f' while scheduling {target.canonic_name}')
+                    image_map = None
+                results.put((target, image_map))
+
+        def feed():
+            for target in targets:
+                tasks.put(target)
+            for _ in range(self.jobs):
+                tasks.put(None)
+
+        workers = [threading.Thread(target=work, daemon=True) for _ in range(self.jobs)]
+        for worker in workers:
+            worker.start()
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        for _ in targets:
+            target, image_map = results.get()
+            if image_map is not None:
+                on_done(target, image_map)
+
+        feeder.join()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+
+from builder.modules.load import get_image_summary
+from builder.color_print import *
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+shard_dir = os.path.join(root_dir, '.cache', 'shards')
+
+
+class Shard:
+    """One of ``count`` runners splitting a build between them.
+
+    Targets are dealt out longest ``LastBuildDuration`` first, each to the runner with the least work so far,
+    so every runner computes the same partition from the same history and they finish at about the same time.
+    A runner writes the images it built to a partial history instead of the api files and the database;
+    ``merge`` folds the partial histories back into the full one.
+    """
+
+    def __init__(self, index, count):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f'shard {index}/{count} is out of range, expected 1/N to N/N')
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value):
+        try:
+            index, count = (int(v) for v in value.split('/'))
+        except ValueError:
+            raise ValueError(f'shard "{value}" should look like i/N')
+        return cls(index, count)
+
+    def __str__(self):
+        return f'{self.index}/{self.count}'
+
+    @property
+    def default_path(self):
+        return os.path.join(shard_dir, f'{self.index}-of-{self.count}.json')
+
+    def partition(self, targets, history, get_name):
+        durations = {t: get_image_summary(history, get_name(t)).get('LastBuildDuration') for t in targets}
+        known = [d for d in durations.values() if d is not None]
+        # never built images count as an average one, they are as likely to be slow as fast
+        default = sum(known) / len(known) if known else 1
+        loads = [0] * self.count
+        shards = [[] for _ in range(self.count)]
+        for target in sorted(targets, key=lambda t: (-(durations[t] or default), get_name(t))):
+            lightest = loads.index(min(loads))
+            loads[lightest] += durations[target] or default
+            shards[lightest].append(target)
+        return shards, loads
+
+    def select(self, targets, history, get_name):
+        shards, loads = self.partition(targets, history, get_name)
+        print(print_green(f'Shard {self}: ') +
+              f'{len(shards[self.index - 1])} of {len(targets)} targets, ~{loads[self.index - 1]:.0f}s of '
+              f'{sum(loads):.0f}s by last build durations')
+        return shards[self.index - 1]
+
+    def save(self, history, names, path=None, run_id=None):
+        path = path or self.default_path
+        partial = {
+            'Shard': str(self),
+            'RunId': run_id,
+            'UpdatedAt': int(time.time()),
+            'LastBuildReason': history.get('LastBuildReason'),
+            'Images': {name: history['Images'][name] for name in sorted(names)},
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(partial, fp)
+        os.replace(path + '.tmp', path)
+        print(print_green(f'Partial history of shard {self} with {len(names)} images written to ') + path)
+
+    @staticmethod
+    def merge(history, paths):
+        """Fold partial histories into ``history``, returns the names of the images they touched."""
+        merged = set()
+        seen = {}
+        for path in paths:
+            with open(path) as fp:
+                partial = json.load(fp)
+            seen[partial.get('Shard')] = path
+            for name, image_map in partial['Images'].items():
+                current = get_image_summary(history, name)
+                if name in merged and current.get('LastBuildTime', 0) > image_map.get('LastBuildTime', 0):
+                    continue
+                history['Images'][name] = image_map
+                history['LastBuildStatus'][name] = image_map.get('ImageStatus')
+                if image_map.get('LastBuildTime', 0) >= (history.get('LastBuildTime') or 0):
+                    history['LastBuildTime'] = image_map['LastBuildTime']
+                    history['LastBuildReason'] = partial.get('LastBuildReason') or history.get('LastBuildReason')
+                merged.add(name)
+            print(print_green(f'Merged {len(partial["Images"])} images of shard {partial.get("Shard")} from ') + path)
+        counts = {int(shard.split('/')[1]) for shard in seen if shard}
+        for count in counts:
+            missing = [f'{i}/{count}' for i in range(1, count + 1) if f'{i}/{count}' not in seen]
+            if missing:
+                print(print_red(f'Partial histories of shards {", ".join(missing)} are missing'))
+        return merged
@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import shutil
+import tarfile
+import threading
+import subprocess
+
+from builder.color_print import *
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+jinasrc_dir = os.path.join(root_dir, 'src', 'jina')
+cache_dir = os.path.join(root_dir, '.cache', 'jina')
+
+
+class JinaSource:
+    """The jina source tree, exported once per revision and shared by every build as a named build context.
+
+    Instead of copying ``src/jina`` into every target, buildx gets ``--build-context jina=<export>`` and the
+    Dockerfile's ``COPY jina ...`` lines are pointed at that context. The export lives under ``.cache/jina``
+    keyed by revision, so it is reused across targets and across runs until jina moves; the exports of older
+    revisions are removed then.
+    """
+
+    context_name = 'jina'
+    _lock = threading.Lock()
+    _instance = None
+
+    def __init__(self, src_dir=jinasrc_dir):
+        self.src_dir = src_dir
+        self.revision = self.get_revision(src_dir)
+        self.path = os.path.join(cache_dir, self.revision or 'worktree')
+        self.exported = False
+
+    @classmethod
+    def get(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @staticmethod
+    def get_revision(src_dir=jinasrc_dir):
+        """HEAD of the jina checkout, empty when ``src_dir`` is not the top of a git checkout of its own."""
+        try:
+            r = subprocess.check_output(['git', '-C', src_dir, 'rev-parse', '--show-toplevel', 'HEAD'],
+                                        stderr=subprocess.DEVNULL)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return ''
+        toplevel, revision = r.decode().split()
+        # a plain directory inside another checkout would hand out the HEAD of the enclosing repo
+        if os.path.realpath(toplevel) != os.path.realpath(src_dir):
+            return ''
+        return revision
+
+    def archive(self, dst):
+        os.makedirs(dst)
+        with subprocess.Popen(['git', '-C', self.src_dir, 'archive', self.revision],
+                              stdout=subprocess.PIPE) as proc:
+            try:
+                with tarfile.open(fileobj=proc.stdout, mode='r|') as archive:
+                    archive.extractall(dst)
+            finally:
+                proc.stdout.close()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+    def copy(self, dst):
+        shutil.copytree(self.src_dir, dst, ignore=shutil.ignore_patterns('.git', '__pycache__'))
+
+    def export(self):
+        with self._lock:
+            if os.path.isdir(self.path) and (self.revision or self.exported):
+                return self.path
+            tmp_path = self.path + '.tmp'
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if self.revision:
+                print(print_green('Exporting jina source ') + self.revision)
+                try:
+                    self.archive(tmp_path)
+                except (subprocess.CalledProcessError, tarfile.TarError, OSError) as e:
+                    print(print_yellow(f'Can\'t export jina source with git archive ({e}), copying it instead'))
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    self.copy(tmp_path)
+            else:
+                # not a git checkout, nothing to key on: refresh the copy every run
+                self.copy(tmp_path)
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.replace(tmp_path, self.path)
+            self.exported = True
+            self.prune()
+            return self.path
+
+    def prune(self):
+        """Remove the exports of other revisions, only the current one is ever used again."""
+        export_dir = os.path.dirname(self.path)
+        for name in os.listdir(export_dir):
+            path = os.path.join(export_dir, name)
+            if path != self.path:
+                print(print_yellow('Removing old jina source export ') + name)
+                shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def rewrite_dockerfile(cls, lines):
+        """Point ``COPY``/``ADD`` of the jina tree at the named context.
+
+        Returns ``None`` when the Dockerfile uses jina in a way that can not be rewritten safely.
+        """
+        copy_regex = r'^(?P<cmd>COPY|ADD)\s+(?P<flags>(--\S+\s+)*)(?P<args>.*)$'
+        revised = []
+        for line in lines:
+            m = re.match(copy_regex, line.strip(), flags=re.IGNORECASE)
+            if not m or '--from' in m.group('flags'):
+                revised.append(line)
+                continue
+            args = m.group('args').strip()
+            exec_form = args.startswith('[')
+            try:
+                *sources, dest = json.loads(args) if exec_form else args.split()
+            except ValueError:
+                return None
+            sources = [os.path.normpath(s.lstrip('/')) for s in sources]
+            if any(s.startswith('jina/') for s in sources):
+                # only part of the tree is used, the context holds all of it under another root
+                return None
+            if 'jina' in sources:
+                if len(sources) > 1 or exec_form:
+                    return None
+                revised.append(f'COPY {m.group("flags")}--from={cls.context_name} . {dest}\n')
+            elif '.' in sources and not exec_form:
+                # the whole target dir used to carry a jina copy along
+                revised.append(line)
+                dest = dest if dest.endswith('/') else dest + '/'
+                revised.append(f'COPY {m.group("flags")}--from={cls.context_name} . {dest}jina/\n')
+            elif '.' in sources:
+                return None
+            else:
+                revised.append(line)
+        return revised
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+from builder.color_print import *
+
+
+class PhaseTimer:
+    """Wall-clock durations of the named phases of one target build."""
+
+    def __init__(self):
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + duration
+
+    def as_dict(self):
+        with self.lock:
+            return {name: round(duration, 3) for name, duration in self.phases.items()}
+
+
+class RunMetrics:
+    """Collects the phase timings of every image built in a run, prints a summary and exports them."""
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id
+        self.images = {}
+
+    def add(self, image_map):
+        self.images[image_map['ImageName']] = {
+            'status': bool(image_map.get('ImageStatus')),
+            'timestamp': image_map.get('LastBuildTime'),
+            'duration': image_map.get('LastBuildDuration'),
+            'phases': image_map.get('Phases') or {},
+        }
+
+    def get_phase_totals(self):
+        totals = {}
+        for name, image in self.images.items():
+            for phase, duration in image['phases'].items():
+                total = totals.setdefault(phase, {'total': 0, 'count': 0, 'max': 0, 'slowest': None})
+                total['total'] += duration
+                total['count'] += 1
+                if duration >= total['max']:
+                    total['max'], total['slowest'] = duration, name
+        return totals
+
+    def print_summary(self):
+        if not self.images:
+            return
+        print(print_green(f'\nPhase timings over {len(self.images)} images'))
+        totals = self.get_phase_totals()
+        for phase, total in sorted(totals.items(), key=lambda item: -item[1]['total']):
+            print(print_purple(f'{phase:>14}') +
+                  f' total {total["total"]:9.1f}s  mean {total["total"] / total["count"]:8.1f}s'
+                  f'  max {total["max"]:8.1f}s ({total["slowest"]})')
+
+    def export(self, metrics_path):
+        if metrics_path.endswith('.prom'):
+            self.export_prometheus(metrics_path)
+        else:
+            self.export_json_lines(metrics_path)
+        print(print_green('Build metrics exported to ') + metrics_path)
+
+    def export_prometheus(self, metrics_path):
+        lines = [
+            '# HELP hub_builder_phase_seconds Duration of a build phase of a hub image.',
+            '# TYPE hub_builder_phase_seconds gauge',
+        ]
+        for name, image in sorted(self.images.items()):
+            for phase, duration in image['phases'].items():
+                lines.append(f'hub_builder_phase_seconds{{image="{name}",phase="{phase}"}} {duration}')
+        lines += [
+            '# HELP hub_builder_build_success Whether the last build of a hub image succeeded.',
+            '# TYPE hub_builder_build_success gauge',
+        ]
+        for name, image in sorted(self.images.items()):
+            lines.append(f'hub_builder_build_success{{image="{name}"}} {int(image["status"])}')
+        # node exporter may read the textfile at any time, never let it see a partial one
+        with open(metrics_path + '.tmp', 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        os.replace(metrics_path + '.tmp', metrics_path)
+
+    def export_json_lines(self, metrics_path):
+        with open(metrics_path, 'a') as fp:
+            for name, image in sorted(self.images.items()):
+                fp.write(json.dumps(dict(image, image=name, run_id=self.run_id)) + '\n')
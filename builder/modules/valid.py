@@ -1,16 +1,39 @@
 import os
 import re
+import threading
 
 from ruamel.yaml import YAML
 yaml = YAML()
 
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+osi_approved_yml_path = os.path.join(os.path.dirname(cur_dir), 'osi-approved.yml')
+platforms_yml_path = os.path.join(os.path.dirname(cur_dir), 'platforms.yml')
+
 
 class Validator:
 
+    rules = {}
+    lock = threading.Lock()
+
     def __init__(self, target):
         self.target = target
         self.check_chain()
 
+    @classmethod
+    def load_rules(cls, rules_path):
+        # rule files are read once per process, not once per target; targets are validated from scheduler
+        # threads too, and the shared parser keeps its state between loads
+        with cls.lock:
+            if rules_path not in cls.rules:
+                with open(rules_path) as yml:
+                    cls.rules[rules_path] = yaml.load(yml)
+            return cls.rules[rules_path]
+
+    @classmethod
+    def preload(cls):
+        cls.load_rules(osi_approved_yml_path)
+        cls.load_rules(platforms_yml_path)
+
     def check_chain(self):
         self.check_name()
         self.check_version()
@@ -33,21 +56,15 @@ class Validator:
             raise ValueError(f'{version} is not a valid semantic version number, see http://semver.org/')
 
     def check_license(self):
-        cur_dir = os.path.dirname(os.path.abspath(__file__))
-        osi_approved_yml_path = os.path.join(os.path.dirname(cur_dir), 'osi-approved.yml')
         license_ = self.target.manifest.get('license', {})
-        with open(osi_approved_yml_path) as fp:
-            approved = yaml.load(fp)
+        approved = self.load_rules(osi_approved_yml_path)
         if license_ not in approved:
             raise ValueError(f"license {license_} is not an OSI-approved license {approved}")
         return approved[license_]
 
     def check_platform(self):
-        cur_dir = os.path.dirname(os.path.abspath(__file__))
-        platforms_yml_path = os.path.join(os.path.dirname(cur_dir), 'platforms.yml')
         platforms = self.target.manifest.get('platform', {})
-        with open(platforms_yml_path) as yml:
-            supported_platforms = yaml.load(yml)
+        supported_platforms = self.load_rules(platforms_yml_path)
 
         for user_added_platform in platforms:
             if user_added_platform not in supported_platforms:
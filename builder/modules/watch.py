@@ -0,0 +1,163 @@
+import os
+import time
+import heapq
+import signal
+import threading
+
+from builder.modules.target import Target
+from builder.modules.index import GitIndex
+from builder.modules.manifest import ManifestLoader
+from builder.modules.schedule import Scheduler
+from builder.modules.load import get_image_summary
+from builder.color_print import *
+
+strategy_levels = {
+    'never': 10,
+    'manually': 20,
+    'on-release': 30,
+    'nightly': 40,
+    'on-master': 50
+}
+
+
+class HubWatcher:
+    """Keeps the builder running and builds targets as soon as their files change.
+
+    The hub checkout is polled every ``interval`` seconds: its HEAD, and the mtime of every target file as
+    listed through the discovery index. A target is queued once its files have been quiet for ``debounce``
+    seconds, so a burst of commits or a checkout in progress ends up as a single build. The queue serves
+    eager ``update`` strategies first, then the targets that build fastest. History, discovery index and
+    manifests stay in memory between builds, and the outputs are flushed after every batch.
+    """
+
+    def __init__(self, builder, state, history, interval=30, debounce=10):
+        self.builder = builder
+        self.state = state
+        self.history = history
+        self.interval = interval
+        self.debounce = debounce
+        self.hub_dir = os.path.dirname(builder.discovery.path)
+        self.head = GitIndex.get_head(self.hub_dir)
+        self.mtimes = {}
+        self.pending = {}
+        self.queue = []
+        self.queued = set()
+        self.counter = 0
+        self.stop = threading.Event()
+
+    def snapshot(self):
+        mtimes = {}
+        for file_path in self.builder.discovery.iter_files():
+            try:
+                mtimes[file_path] = os.stat(file_path).st_mtime_ns
+            except OSError:
+                pass
+        return mtimes
+
+    def poll(self):
+        """Collect the targets changed since the last poll into ``pending``."""
+        head = GitIndex.get_head(self.hub_dir)
+        if head != self.head:
+            print(print_green('Hub moved to ') + str(head))
+            self.head = head
+            # commit times and the stamped revision come from HEAD, drop what was derived from the old one
+            self.builder._index = None
+            self.builder._fingerprint = None
+            ManifestLoader.revision = None
+        mtimes = self.snapshot()
+        changed = {f for f, mtime in mtimes.items() if self.mtimes.get(f) != mtime}
+        changed.update(f for f in self.mtimes if f not in mtimes)
+        self.mtimes = mtimes
+        now = time.time()
+        for target in {self.get_target_dir(f) for f in changed} - {None}:
+            self.pending[target] = now
+            if self.builder._fingerprint is not None:
+                self.builder.fingerprint.cache.pop(target, None)
+
+    def get_target_dir(self, file_path):
+        """The nearest directory above ``file_path`` holding a ``manifest.yml``, ``None`` outside of targets."""
+        hub_dir = os.path.abspath(self.hub_dir)
+        path = os.path.dirname(os.path.abspath(file_path))
+        while path.startswith(hub_dir + os.sep):
+            if os.path.isfile(os.path.join(path, 'manifest.yml')):
+                return path
+            path = os.path.dirname(path)
+        return None
+
+    def get_priority(self, target):
+        level = strategy_levels.get(target.manifest.get('update', 'nightly'), 0)
+        duration = get_image_summary(self.history, target.canonic_name).get('LastBuildDuration') or 0
+        return -level, duration
+
+    def enqueue(self, paths):
+        for path in sorted(paths):
+            if path in self.queued or not os.path.isfile(os.path.join(path, 'manifest.yml')):
+                continue
+            try:
+                target = Target(path)
+            except Exception as e:
+                print(print_red(e) + f' while loading {path}')
+                self.builder.record_invalid(self.history, path, str(e))
+                continue
+            if not self.builder.check_update_strategy(target):
+                continue
+            image = get_image_summary(self.history, target.canonic_name)
+            if self.builder.is_up_to_date(image, path):
+                continue
+            self.counter += 1
+            heapq.heappush(self.queue, (self.get_priority(target), self.counter, path, target))
+            self.queued.add(path)
+            print(print_green('Queued target ') + target.canonic_name)
+
+    def release_settled(self):
+        now = time.time()
+        settled = [t for t, changed_at in self.pending.items() if now - changed_at >= self.debounce]
+        for target in settled:
+            del self.pending[target]
+        self.enqueue(settled)
+
+    def next_batch(self, size):
+        batch = []
+        while self.queue and len(batch) < size:
+            _, _, path, target = heapq.heappop(self.queue)
+            self.queued.discard(path)
+            batch.append(target)
+        return batch
+
+    def build(self, batch):
+        on_done = lambda target, image_map: self.builder.on_build_done(self.history, target, image_map)
+        if len(batch) == 1:
+            self.builder.build_single(batch[0], self.history)
+        else:
+            scheduler = Scheduler(self.builder.build_target, self.history, jobs=len(batch),
+                                  error_fn=self.builder.get_build_error_map)
+            scheduler.run(batch, on_done=on_done, ordered=True)
+        self.flush()
+
+    def flush(self):
+        if not self.builder.updated_images:
+            return
+        self.state.update_total_history(self.history, self.builder.updated_images)
+        self.builder.updated_images = set()
+        self.builder.journal.discard()
+
+    def handle_signal(self, signum, frame):
+        print(print_yellow('Stopping after the builds in progress'))
+        self.stop.set()
+
+    def run(self, targets=()):
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        self.mtimes = self.snapshot()
+        self.enqueue({os.path.abspath(t) for t in targets})
+        print(print_green(f'Watching {self.hub_dir} every {self.interval}s, {len(self.queue)} targets queued'))
+        while not self.stop.is_set():
+            batch = self.next_batch(max(1, self.builder.args.jobs or 1))
+            if batch:
+                self.build(batch)
+            else:
+                self.stop.wait(self.interval)
+            if not self.stop.is_set():
+                self.poll()
+                self.release_settled()
+        self.flush()
@@ -0,0 +1,58 @@
+import os
+import sys
+import textwrap
+
+import pytest
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from builder.modules import manifest as manifest_module
+from builder.modules.manifest import ManifestLoader
+
+default_manifest = '''\
+name: Dummy
+description: a dummy executor
+author: Jina AI Dev-Team (dev-team@jina.ai)
+version: 0.0.1
+license: apache-2.0
+platform:
+  - linux/amd64
+  - linux/arm64
+update: nightly
+'''
+
+default_dockerfile = '''\
+FROM jinaai/jina:devel AS base
+RUN pip install numpy
+
+FROM base
+COPY . /workspace
+WORKDIR /workspace
+ENTRYPOINT ["jina", "pod", "--uses", "config.yml"]
+'''
+
+
+@pytest.fixture
+def hub(tmp_path, monkeypatch):
+    """An empty ``hub`` directory in the working directory, so canonic names come out as on the runners."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(manifest_module, 'cache_dir', str(tmp_path / '.cache' / 'manifests'))
+    monkeypatch.setattr(ManifestLoader, 'revision', 'abc1234')
+    hub_dir = tmp_path / 'hub'
+    hub_dir.mkdir()
+    return hub_dir
+
+
+@pytest.fixture
+def make_target(hub):
+    def make_target(rel_path='encoders/dummy', manifest=default_manifest, dockerfile=default_dockerfile, files=None):
+        target_dir = hub / rel_path
+        target_dir.mkdir(parents=True)
+        (target_dir / 'manifest.yml').write_text(textwrap.dedent(manifest))
+        (target_dir / 'Dockerfile').write_text(textwrap.dedent(dockerfile))
+        for name, content in (files or {}).items():
+            (target_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (target_dir / name).write_text(content)
+        return os.path.relpath(target_dir)
+    return make_target
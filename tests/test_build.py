@@ -0,0 +1,125 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app import get_parser
+from builder.modules import build, journal
+from builder.modules.build import Builder
+from builder.modules.plan import BuildPlan
+from builder.modules.target import Target
+from builder.modules.valid import Validator
+
+invalid_manifest = '''\
+name: Dummy
+description: a dummy executor
+version: 0.0.1
+update: {update}
+unknown: key
+'''
+
+
+@pytest.fixture
+def make_builder(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, 'journal_dir', str(tmp_path / '.cache' / 'journal'))
+
+    def make_builder(*argv):
+        return Builder(get_parser().parse_args(list(argv)))
+    return make_builder
+
+
+def empty_history():
+    return {'Images': {}, 'LastBuildTime': {}, 'LastBuildStatus': {}, 'LastBuildReason': ''}
+
+
+def test_invalid_targets_recorded_only_when_selected(make_target, make_builder):
+    nightly = make_target('encoders/nightly', manifest=invalid_manifest.format(update='nightly'))
+    never = make_target('encoders/never', manifest=invalid_manifest.format(update='never'))
+    builder = make_builder('--update-strategy', 'nightly')
+    history = empty_history()
+
+    builder.build_multiple([nightly, never], history)
+
+    assert set(history['Images']) == {'hub.encoders.nightly'}
+    image = history['Images']['hub.encoders.nightly']
+    assert image['ImageStatus'] is False
+    assert 'unknown' in image['ValidationError']
+    assert history['LastBuildStatus'] == {'hub.encoders.nightly': False}
+
+
+def test_build_error_recorded_as_failed_image(make_target, make_builder, monkeypatch):
+    path = make_target()
+    builder = make_builder('--update-strategy', 'force', '--jobs', '2')
+    monkeypatch.setattr(builder, 'build_target', lambda target, image: 1 / 0)
+    monkeypatch.setattr(BuildPlan, 'pull_bases', lambda self, jobs=4, cache=None: None)
+    history = empty_history()
+
+    builder.build_multiple([path, make_target('encoders/other')], history)
+
+    for name in ('hub.encoders.dummy', 'hub.encoders.other'):
+        image = history['Images'][name]
+        assert image['ImageStatus'] is False
+        assert image['BuildError'] == 'ZeroDivisionError: division by zero'
+        assert list(image['ImageBuilds'].values()) == [False]
+    assert builder.journal.restore().keys() == {'hub.encoders.dummy', 'hub.encoders.other'}
+
+
+def test_shared_yaml_files_load_from_threads(monkeypatch):
+    monkeypatch.setattr(Builder, '_common_keys', None)
+    monkeypatch.setattr(Validator, 'rules', {})
+    errors = []
+
+    def load():
+        try:
+            assert Builder.common_keys()['vendor']
+            Validator.preload()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(Validator.rules) == 2
+
+
+def test_failed_targets_wait_for_changed_inputs(make_target, make_builder, monkeypatch, capsys):
+    path = os.path.abspath(make_target())
+    builder = make_builder('--update-strategy', 'nightly', '--check-targets')
+    builder.discovery = SimpleNamespace(iter_files=lambda: [os.path.join(path, 'manifest.yml')])
+    monkeypatch.setattr(builder, 'get_builder_update_history', lambda: 0)
+    history = empty_history()
+    builder.update_history(history, builder.get_build_error_map(Target(path), {}, RuntimeError('boom')))
+    image = history['Images']['hub.encoders.dummy']
+    monkeypatch.setattr(build.StateLoader, 'get_history', lambda self: history)
+
+    assert image['Fingerprint'] == builder.fingerprint.get(path)
+    with pytest.raises(SystemExit) as e:
+        builder.check_targets()
+    assert e.value.code == 1
+    assert 'Nothing to build' in capsys.readouterr().out
+
+    # a good build of other inputs does not hide the failure of the current ones
+    image.update({'ImageStatus': True, 'LastGoodFingerprint': 'before'})
+    assert builder.get_targets(history, get_all=False) == {path}
+
+    image.update({'ImageStatus': False, 'LastGoodFingerprint': image['Fingerprint']})
+    with open(os.path.join(path, 'Dockerfile'), 'a') as fp:
+        fp.write('RUN true\n')
+    builder._fingerprint = None
+    assert builder.get_targets(history, get_all=False) == {path}
+
+
+def test_build_records_metrics_without_run(make_target, make_builder):
+    path = make_target()
+    builder = make_builder('--update-strategy', 'force')
+    history = empty_history()
+
+    target = Target(path)
+    builder.on_build_done(history, target, builder.get_build_error_map(target, {}, RuntimeError('boom')))
+
+    assert builder.metrics.images['hub.encoders.dummy']['status'] is False
+    assert builder.journal.restore().keys() == {'hub.encoders.dummy'}
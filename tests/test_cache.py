@@ -0,0 +1,61 @@
+import os
+import json
+
+import pytest
+
+from builder.modules import cache as cache_module
+from builder.modules.cache import BuildCache
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(cache_module.subprocess, 'call', lambda cmd, **kwargs: calls.append(cmd) or 0)
+    return calls
+
+
+def build(cache, name, size, now, monkeypatch):
+    cache.acquire(name)
+    new_dir = cache.get_target_dir(name) + '.new'
+    os.makedirs(new_dir)
+    with open(os.path.join(new_dir, 'index.json'), 'wb') as fp:
+        fp.write(b'0' * size)
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now)
+    cache.release(name, [f'jinaai/{name}:latest'], success=True)
+
+
+def test_release_records_size(tmp_path, calls, monkeypatch):
+    cache = BuildCache(str(tmp_path), budget_gb=1)
+    build(cache, 'hub.a', 100, 10, monkeypatch)
+
+    with open(cache.ledger_path) as fp:
+        ledger = json.load(fp)
+    assert ledger['hub.a'] == {'LastUsed': 10, 'Images': ['jinaai/hub.a:latest'], 'Size': 100}
+    assert cache.acquire('hub.a')[:2] == ['--cache-from', f'type=local,src={cache.get_target_dir("hub.a")}']
+
+
+def test_collect_evicts_least_recently_used(tmp_path, calls, monkeypatch):
+    cache = BuildCache(str(tmp_path), budget_gb=250 / 1024 ** 3)
+    build(cache, 'hub.a', 100, 10, monkeypatch)
+    build(cache, 'hub.b', 100, 20, monkeypatch)
+    cache.collect()
+    assert calls == []
+
+    build(cache, 'hub.c', 100, 30, monkeypatch)
+    monkeypatch.setattr(cache, 'get_dir_size', lambda path: pytest.fail('sizes come from the ledger'))
+    cache.collect()
+
+    assert sorted(cache.ledger) == ['hub.b', 'hub.c']
+    assert not os.path.exists(cache.get_target_dir('hub.a'))
+    assert ['docker', 'rmi', '-f', 'jinaai/hub.a:latest'] in calls
+    assert calls[-1] == ['docker', 'buildx', 'prune', '-f', '--keep-storage', str(cache.budget)]
+
+
+def test_collect_skips_targets_in_use(tmp_path, calls, monkeypatch):
+    cache = BuildCache(str(tmp_path), budget_gb=150 / 1024 ** 3)
+    build(cache, 'hub.a', 100, 10, monkeypatch)
+    build(cache, 'hub.b', 100, 20, monkeypatch)
+    cache.acquire('hub.a')
+    cache.collect()
+
+    assert sorted(cache.ledger) == ['hub.a']
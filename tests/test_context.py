@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from builder.modules import context
+from builder.modules.context import BuildContext, IgnoreRules
+
+dockerfile = '''\
+FROM python:3.7
+COPY requirements.txt /
+COPY src/ /workspace/src/
+'''
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(context, 'contexts_dir', str(tmp_path / '.cache' / 'contexts'))
+    monkeypatch.setattr(context, 'hashes_path', str(tmp_path / '.cache' / 'context-hashes.json'))
+    monkeypatch.setattr(BuildContext, 'hashes', None)
+
+
+@pytest.fixture
+def target_dir(make_target):
+    return make_target(dockerfile=dockerfile, files={
+        'requirements.txt': 'numpy\n',
+        'src/encoder.py': 'x = 1\n',
+        'src/__pycache__/encoder.pyc': 'bytecode',
+        'weights/model.bin': '0' * 1024,
+        '.dockerignore': '**/__pycache__\n',
+    })
+
+
+def prepare(target_dir, **kwargs):
+    return BuildContext(target_dir, os.path.join(target_dir, 'Dockerfile'), 'hub.encoders.dummy').prepare(**kwargs)
+
+
+def test_ignore_rules():
+    rules = IgnoreRules(['# comment', 'weights', '*.md', '!README.md', '**/*.pyc'])
+
+    assert rules.is_ignored('weights/model.bin')
+    assert rules.is_ignored('NOTES.md')
+    assert not rules.is_ignored('README.md')
+    assert rules.is_ignored('src/deep/module.pyc')
+    assert not rules.is_ignored('src/module.py')
+
+
+def test_minimal_context_links_copied_files(target_dir):
+    build_context = prepare(target_dir)
+
+    assert build_context.files == ['requirements.txt', 'src/encoder.py']
+    assert build_context.path != os.path.abspath(target_dir)
+    assert sorted(os.listdir(build_context.path)) == ['requirements.txt', 'src']
+    assert build_context.digest is None
+
+
+def test_whole_directory_copy_uses_target_dir(make_target):
+    target_dir = make_target(dockerfile='FROM python:3.7\nCOPY . /workspace\n', files={'a.py': ''})
+
+    build_context = prepare(target_dir, digest=True)
+
+    assert build_context.path == os.path.abspath(target_dir)
+    assert 'a.py' in build_context.files
+    assert not os.path.exists(context.contexts_dir)
+
+
+def test_digest_follows_content(target_dir):
+    first = prepare(target_dir, digest=True).digest
+    assert prepare(target_dir, digest=True).digest == first
+
+    with open(os.path.join(target_dir, 'weights', 'model.bin'), 'w') as fp:
+        fp.write('not copied')
+    assert prepare(target_dir, digest=True).digest == first
+
+    with open(os.path.join(target_dir, 'src', 'encoder.py'), 'w') as fp:
+        fp.write('x = 2\n')
+    assert prepare(target_dir, digest=True).digest != first
+
+
+def test_digest_in_worker_processes(target_dir, monkeypatch):
+    inline = prepare(target_dir, digest=True).digest
+    monkeypatch.setattr(context, 'pool_threshold', 0)
+    monkeypatch.setattr(BuildContext, 'hashes', {})
+
+    build_context = BuildContext(target_dir, os.path.join(target_dir, 'Dockerfile'), 'hub.encoders.dummy', jobs=2)
+
+    assert build_context.prepare(digest=True).digest == inline
@@ -0,0 +1,110 @@
+import pytest
+
+from builder.modules.load import Mongo, ImageHistory
+from builder.modules.retention import BuildLogRetention
+
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def mongo():
+    mongo = Mongo(connect=False)
+    mongo.db = mongomock.MongoClient()['jina-test']
+    return mongo
+
+
+def make_image(name, builds, durations=None):
+    last = max(builds, key=int)
+    return {
+        'ImageName': name,
+        'ImageStatus': builds[last],
+        'LastBuildTime': int(last),
+        'LastBuildDuration': (durations or {}).get(last),
+        'Fingerprint': f'fp-{name}',
+        'Inspect': [{'Id': 'sha256:abc'}],
+        'ImageBuilds': dict(builds),
+        'ImageBuildDurations': dict(durations or {}),
+    }
+
+
+def legacy_history():
+    return {
+        '_id': 1,
+        'Images': {
+            'hub.encoders.a': make_image('hub.encoders.a', {'10': True, '20': False, '30': True},
+                                         {'10': 1.5, '20': 2.5, '30': 3.5}),
+            'hub.encoders.b': make_image('hub.encoders.b', {'15': True}),
+        },
+        'LastBuildTime': 30,
+        'LastBuildStatus': {'hub.encoders.a': True, 'hub.encoders.b': True},
+        'LastBuildReason': 'nightly',
+    }
+
+
+def test_write_and_lazy_read(mongo):
+    history = legacy_history()
+    del history['_id']
+    mongo.update_history_on_db(history)
+
+    loaded = mongo.get_history_from_database()
+    images = loaded['Images']
+    assert isinstance(images, ImageHistory)
+    assert images.partial == {'hub.encoders.a', 'hub.encoders.b'}
+    # summaries are there without fetching the full documents
+    assert dict.get(images, 'hub.encoders.a') == {
+        'ImageName': 'hub.encoders.a', 'ImageStatus': True, 'LastBuildTime': 30, 'LastBuildDuration': 3.5,
+        'Fingerprint': 'fp-hub.encoders.a',
+    }
+    assert images['hub.encoders.b']['Inspect'] == [{'Id': 'sha256:abc'}]
+    assert images.partial == {'hub.encoders.a'}
+    assert loaded['LastBuildReason'] == 'nightly'
+    assert 'Images' not in mongo.db.status.find_one({'_id': 1})
+
+
+def test_update_touches_only_given_images(mongo):
+    history = legacy_history()
+    mongo.update_history_on_db(history)
+    history['Images']['hub.encoders.b'] = make_image('hub.encoders.b', {'15': True, '40': False})
+    history['Images']['hub.encoders.a']['Fingerprint'] = 'changed, but not rebuilt'
+    mongo.update_history_on_db(history, images={'hub.encoders.b'})
+
+    images = mongo.get_history_from_database()['Images']
+    assert images['hub.encoders.b']['ImageStatus'] is False
+    assert images['hub.encoders.b']['ImageBuilds'] == {'15': True, '40': False}
+    assert images['hub.encoders.a']['Fingerprint'] == 'fp-hub.encoders.a'
+
+
+def test_migration_keeps_build_log(mongo):
+    mongo.db.docker.insert_one(legacy_history())
+
+    history = mongo.get_history_from_database()
+    assert mongo.migrate
+    mongo.update_history_on_db(history)
+    assert not mongo.migrate
+
+    images = mongo.get_history_from_database()['Images']
+    assert images['hub.encoders.a']['ImageBuilds'] == {'10': True, '20': False, '30': True}
+    assert images['hub.encoders.b']['ImageBuilds'] == {'15': True}
+    assert mongo.db.builds.find_one({'_id': 'hub.encoders.a:20'})['LastBuildDuration'] == 2.5
+    assert mongo.db.builds.count_documents({}) == 4
+
+
+def test_compaction_prunes_build_events(mongo):
+    retention = BuildLogRetention(keep=2, period='daily')
+    builds = {str(day * 86400): bool(day % 2) for day in range(1, 6)}
+    history = legacy_history()
+    history['Images']['hub.encoders.a'] = make_image('hub.encoders.a', builds)
+    mongo.db.docker.insert_one(history)
+    mongo.update_history_on_db(mongo.get_history_from_database())
+    assert mongo.db.builds.count_documents({'ImageName': 'hub.encoders.a'}) == 5
+
+    for _ in range(2):
+        history = mongo.get_history_from_database()
+        history['Images'] = history['Images'].materialize()
+        retention.compact_history(history)
+        mongo.update_history_on_db(history)
+
+    image = mongo.get_history_from_database()['Images']['hub.encoders.a']
+    assert image['ImageBuilds'] == {'345600': False, '432000': True}
+    assert sum(p['Success'] + p['Failure'] for p in image['ImageBuildStats'].values()) == 3
+    assert mongo.db.builds.count_documents({'ImageName': 'hub.encoders.a'}) == 2
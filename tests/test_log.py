@@ -0,0 +1,48 @@
+import gzip
+import subprocess
+
+import pytest
+
+from builder.modules.log import BuildLog
+from builder.modules.target import Target
+
+
+def test_run_streams_output_and_keeps_failure_tail(tmp_path):
+    log = BuildLog(str(tmp_path / 'image.log.gz'), tail=2, echo=False)
+    log.run('ok', ['echo', 'hello'])
+    with pytest.raises(subprocess.CalledProcessError):
+        log.run('fail', ['sh', '-c', 'echo one; echo two; echo three; exit 3'])
+    log.close()
+
+    with gzip.open(tmp_path / 'image.log.gz') as fp:
+        content = fp.read().decode()
+    assert '[ok] hello' in content
+    assert '[fail] one' in content
+    assert log.failures == {'fail': {'ReturnCode': 3, 'Tail': ['two', 'three']}}
+
+
+def test_secrets_never_reach_the_log(tmp_path):
+    log = BuildLog(str(tmp_path / 'image.log.gz'), echo=False)
+    log.run('login', ['echo', '-e', 'DOCKERHUB_PASSWORD=hunter2', 'API_TOKEN=abc', 'NAME=visible'])
+    log.close()
+
+    with gzip.open(tmp_path / 'image.log.gz') as fp:
+        command = fp.readline().decode()
+    assert 'hunter2' not in command and 'abc' not in command
+    assert 'DOCKERHUB_PASSWORD=***' in command and 'NAME=visible' in command
+
+
+def test_readme_push_passes_credentials_through_environment(make_target, monkeypatch):
+    monkeypatch.setenv('DOCKERHUB_DEVBOT_USER', 'bot')
+    monkeypatch.setenv('DOCKERHUB_DEVBOT_PWD', 'hunter2')
+    target = Target(make_target())
+    calls = []
+    monkeypatch.setattr(target.log, 'run', lambda step, cmd, **kwargs: calls.append((cmd, kwargs)) or 0)
+
+    target.push_image_readme()
+
+    (cmd, kwargs), = calls
+    assert not any('hunter2' in arg for arg in cmd)
+    assert 'DOCKERHUB_PASSWORD' in cmd
+    assert kwargs['env']['DOCKERHUB_PASSWORD'] == 'hunter2'
+    assert kwargs['env']['DOCKERHUB_USERNAME'] == 'bot'
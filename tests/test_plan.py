@@ -0,0 +1,48 @@
+from builder.modules import plan as plan_module
+from builder.modules.plan import BuildPlan
+from builder.modules.target import Target
+
+
+def test_base_images(make_target):
+    path = make_target(dockerfile='''\
+        ARG JINA_VERSION=devel
+        FROM jinaai/jina:${JINA_VERSION} AS base
+        FROM python:3.7-slim AS weights
+        FROM base
+        COPY --from=weights /weights /weights
+        ''')
+
+    assert BuildPlan.get_base_images(f'{path}/Dockerfile') == ['jinaai/jina:devel', 'python:3.7-slim']
+
+
+def test_targets_grouped_by_base(make_target):
+    targets = [Target(make_target(f'encoders/{name}', dockerfile=f'FROM {base}\n'))
+               for name, base in [('a', 'python:3.7'), ('b', 'jinaai/jina:devel'), ('c', 'python:3.7')]]
+    durations = {'hub.encoders.a': 10, 'hub.encoders.b': 15, 'hub.encoders.c': 20}
+
+    ordered = BuildPlan(targets).order(targets, lambda t: durations[t.canonic_name])
+
+    assert [t.canonic_name for t in ordered] == ['hub.encoders.c', 'hub.encoders.a', 'hub.encoders.b']
+
+
+def test_pull_bases_left_to_container_builder(make_target, monkeypatch):
+    calls = []
+    output = b'Name:   builder\nDriver: docker-container\n'
+    monkeypatch.setattr(plan_module.subprocess, 'check_output', lambda cmd, **kwargs: output)
+    monkeypatch.setattr(plan_module.subprocess, 'call', lambda cmd, **kwargs: calls.append(cmd) or 0)
+    plan = BuildPlan([Target(make_target())])
+
+    plan.pull_bases()
+    assert calls == []
+
+    output = b'Name:   default\nDriver: docker\n'
+    plan.pull_bases()
+    assert calls == [['docker', 'pull', '--quiet', 'jinaai/jina:devel']]
+
+
+def test_builder_driver_without_docker(monkeypatch):
+    def check_output(cmd, **kwargs):
+        raise FileNotFoundError(cmd[0])
+    monkeypatch.setattr(plan_module.subprocess, 'check_output', check_output)
+
+    assert BuildPlan.get_builder_driver() is None
@@ -0,0 +1,113 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from builder.modules.registry import RegistryClient
+from builder.modules.target import Target
+
+pytest.importorskip('requests')
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    """A registry v2 stand-in: manifest HEADs behind a bearer token, and the token endpoint."""
+
+    manifests = {}
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path))
+        body = json.dumps({'token': 'secret'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.requests.append(('HEAD', self.path))
+        if self.headers.get('Authorization') != 'Bearer secret':
+            realm = f'http://{self.headers["Host"]}/token'
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', f'Bearer realm="{realm}",service="registry"')
+        elif self.path in self.manifests:
+            self.send_response(200)
+            self.send_header('Docker-Content-Digest', self.manifests[self.path])
+        else:
+            self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+@pytest.fixture
+def registry():
+    RegistryHandler.manifests = {
+        '/v2/hub.encoders.dummy/manifests/sha-known': 'sha256:known',
+        '/v2/jina/manifests/devel': 'sha256:base',
+    }
+    RegistryHandler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RegistryHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'localhost:{server.server_port}/'
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_image_name():
+    assert RegistryClient.parse_image_name('jinaai/hub.encoders.dummy:0.0.1') == \
+        ('https://registry-1.docker.io', 'jinaai/hub.encoders.dummy', '0.0.1')
+    assert RegistryClient.parse_image_name('python') == ('https://registry-1.docker.io', 'library/python', 'latest')
+    assert RegistryClient.parse_image_name('localhost:5000/hub.a:sha-1') == ('http://localhost:5000', 'hub.a', 'sha-1')
+    assert RegistryClient.is_docker_hub('jinaai/jina:devel')
+    assert not RegistryClient.is_docker_hub('ghcr.io/jina-ai/jina:devel')
+
+
+def test_lookup_with_bearer_token(registry):
+    client = RegistryClient()
+
+    assert client.lookup(f'{registry}hub.encoders.dummy:sha-known') is True
+    assert client.lookup(f'{registry}hub.encoders.dummy:sha-missing') is False
+    # the token is asked for once per repository
+    assert [r for r in RegistryHandler.requests if r[0] == 'GET'] == [
+        ('GET', '/token?service=registry&scope=repository%3Ahub.encoders.dummy%3Apull')]
+
+
+def test_lookup_reports_unreachable_registry_as_miss():
+    assert RegistryClient().lookup('localhost:1/hub.encoders.dummy:sha-known') is False
+
+
+def test_get_digest(registry):
+    client = RegistryClient()
+
+    assert client.get_digest(f'{registry}jina:devel') == 'sha256:base'
+    assert client.get_digest(f'{registry}jina:missing') is None
+    assert client.get_digest('python@sha256:pinned') == 'sha256:pinned'
+    heads = len([r for r in RegistryHandler.requests if r[0] == 'HEAD'])
+    assert client.get_digest(f'{registry}jina:devel') == 'sha256:base'
+    assert len([r for r in RegistryHandler.requests if r[0] == 'HEAD']) == heads
+
+
+def test_content_image_name_covers_base_digests(make_target, registry):
+    target = Target(make_target(dockerfile=f'FROM {registry}jina:devel\nCOPY . /workspace\n'))
+    target.update_dockerfile_with_label()
+    target.context = type('Context', (), {'digest': 'context'})()
+    client = RegistryClient()
+
+    name = target.get_content_image_name(registry, 'fingerprint', 'buildx', client)
+    assert name == f'{registry}hub.encoders.dummy:' + Target.get_content_tag(
+        'fingerprint', 'buildx', 'context', [f'{registry}jina:devel@sha256:base'])
+
+    RegistryHandler.manifests['/v2/jina/manifests/devel'] = 'sha256:moved'
+    assert target.get_content_image_name(registry, 'fingerprint', 'buildx', RegistryClient()) != name
+
+
+def test_content_image_name_without_resolvable_base(make_target, registry):
+    target = Target(make_target(dockerfile=f'FROM {registry}jina:gone\n'))
+    target.update_dockerfile_with_label()
+
+    assert target.get_content_image_name(registry, 'fingerprint', 'buildx', RegistryClient()) is None
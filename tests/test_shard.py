@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from builder.modules.shard import Shard
+
+
+def make_history(durations):
+    return {
+        'Images': {name: {'ImageName': name, 'ImageStatus': True, 'LastBuildTime': 100, 'LastBuildDuration': d}
+                   for name, d in durations.items() if d is not None},
+        'LastBuildTime': 100,
+        'LastBuildStatus': {name: True for name, d in durations.items() if d is not None},
+        'LastBuildReason': 'nightly',
+    }
+
+
+@pytest.mark.parametrize('value', ['0/2', '3/2', '1', 'a/b'])
+def test_parse_rejects_bad_shards(value):
+    with pytest.raises(ValueError):
+        Shard.parse(value)
+
+
+def test_partition_is_balanced_and_complete():
+    durations = {'a': 100, 'b': 60, 'c': 50, 'd': 40, 'e': 10, 'new': None}
+    history = make_history(durations)
+    targets = list(durations)
+
+    shards, loads = Shard(1, 2).partition(targets, history, lambda t: t)
+
+    assert sorted(t for shard in shards for t in shard) == sorted(targets)
+    # the never built target counts as an average one
+    assert sum(loads) == 260 + 52
+    assert max(loads) - min(loads) <= 52
+
+
+def test_every_runner_selects_its_own_part():
+    durations = {f't{i}': i * 7 % 13 + 1 for i in range(20)}
+    history = make_history(durations)
+    targets = list(durations)
+
+    selected = [Shard(i, 3).select(list(reversed(targets)) if i == 2 else targets, history, lambda t: t)
+                for i in (1, 2, 3)]
+
+    assert sorted(t for part in selected for t in part) == sorted(targets)
+    assert not set(selected[0]) & set(selected[1])
+
+
+def test_save_and_merge(tmp_path):
+    history = make_history({'a': 10, 'b': 20})
+    paths = []
+    for index, (name, status, built_at) in enumerate([('a', False, 200), ('b', True, 300)], start=1):
+        shard_history = make_history({'a': 10, 'b': 20})
+        shard_history['LastBuildReason'] = f'shard {index}'
+        shard_history['Images'][name] = {'ImageName': name, 'ImageStatus': status, 'LastBuildTime': built_at}
+        paths.append(str(tmp_path / f'{index}-of-3.json'))
+        Shard(index, 3).save(shard_history, [name], paths[-1], run_id='nightly')
+
+    with open(paths[0]) as fp:
+        assert json.load(fp)['Images'] == {'a': {'ImageName': 'a', 'ImageStatus': False, 'LastBuildTime': 200}}
+
+    merged = Shard.merge(history, paths)
+
+    assert merged == {'a', 'b'}
+    assert history['LastBuildStatus'] == {'a': False, 'b': True}
+    assert history['LastBuildTime'] == 300
+    assert history['LastBuildReason'] == 'shard 2'
+    assert history['Images']['b']['LastBuildTime'] == 300
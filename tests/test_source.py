@@ -0,0 +1,104 @@
+import os
+import subprocess
+
+import pytest
+
+from builder.modules import source
+from builder.modules.source import JinaSource
+
+
+def git(cwd, *args):
+    subprocess.check_call(['git', '-C', str(cwd), '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+                          + list(args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+@pytest.fixture
+def jina_repo(tmp_path, monkeypatch):
+    monkeypatch.setattr(source, 'cache_dir', str(tmp_path / '.cache' / 'jina'))
+    src_dir = tmp_path / 'src' / 'jina'
+    (src_dir / 'jina').mkdir(parents=True)
+    (src_dir / 'setup.py').write_text('print("setup")\n')
+    (src_dir / 'jina' / '__init__.py').write_text('__version__ = "0.0.1"\n')
+    return src_dir
+
+
+def test_rewrite_copy_of_jina_tree():
+    revised = JinaSource.rewrite_dockerfile(['FROM python:3.7\n', 'COPY ./jina/ /jina\n', 'RUN pip install /jina\n'])
+
+    assert revised == ['FROM python:3.7\n', 'COPY --from=jina . /jina\n', 'RUN pip install /jina\n']
+
+
+def test_rewrite_copy_of_target_dir_adds_jina():
+    revised = JinaSource.rewrite_dockerfile(['COPY --chown=1000 . /workspace\n'])
+
+    assert revised == ['COPY --chown=1000 . /workspace\n', 'COPY --chown=1000 --from=jina . /workspace/jina/\n']
+
+
+@pytest.mark.parametrize('line', [
+    'COPY jina/setup.py /s/\n',
+    'ADD ./jina/jina /app/jina\n',
+    'COPY jina requirements.txt /app/\n',
+    'COPY ["jina", "/jina"]\n',
+])
+def test_rewrite_refuses_partial_jina_sources(line):
+    assert JinaSource.rewrite_dockerfile(['FROM python:3.7\n', line]) is None
+
+
+def test_rewrite_leaves_other_copies():
+    lines = ['COPY requirements.txt /\n', 'COPY --from=base /usr/lib /usr/lib\n', 'RUN echo jina\n']
+
+    assert JinaSource.rewrite_dockerfile(lines) == lines
+
+
+def test_export_git_checkout(jina_repo):
+    git(jina_repo, 'init', '-q')
+    git(jina_repo, 'add', '.')
+    git(jina_repo, 'commit', '-q', '-m', 'init')
+    (jina_repo / 'untracked.txt').write_text('not exported')
+
+    jina_source = JinaSource(str(jina_repo))
+    path = jina_source.export()
+
+    assert jina_source.revision and path.endswith(jina_source.revision)
+    assert os.path.isfile(os.path.join(path, 'jina', '__init__.py'))
+    assert not os.path.exists(os.path.join(path, 'untracked.txt'))
+
+
+def test_revision_ignores_enclosing_checkout(tmp_path, jina_repo):
+    git(tmp_path, 'init', '-q')
+    (tmp_path / 'README.md').write_text('enclosing repo\n')
+    git(tmp_path, 'add', 'README.md')
+    git(tmp_path, 'commit', '-q', '-m', 'init')
+
+    jina_source = JinaSource(str(jina_repo))
+    path = jina_source.export()
+
+    assert jina_source.revision == ''
+    assert os.path.isfile(os.path.join(path, 'setup.py'))
+
+
+def test_export_falls_back_to_copy_when_archive_fails(jina_repo):
+    git(jina_repo, 'init', '-q')
+    git(jina_repo, 'add', '.')
+    git(jina_repo, 'commit', '-q', '-m', 'init')
+
+    jina_source = JinaSource(str(jina_repo))
+    jina_source.revision = '0' * 40
+    path = jina_source.export()
+
+    assert os.path.isfile(os.path.join(path, 'setup.py'))
+    assert not os.path.exists(os.path.join(path, '.git'))
+
+
+def test_export_removes_older_revisions(jina_repo):
+    git(jina_repo, 'init', '-q')
+    git(jina_repo, 'add', '.')
+    git(jina_repo, 'commit', '-q', '-m', 'init')
+    old_path = JinaSource(str(jina_repo)).export()
+    (jina_repo / 'setup.py').write_text('print("moved")\n')
+    git(jina_repo, 'commit', '-q', '-am', 'move')
+
+    path = JinaSource(str(jina_repo)).export()
+
+    assert path != old_path
+    assert os.listdir(source.cache_dir) == [os.path.basename(path)]
@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from builder.modules import target as target_module
+from builder.modules.manifest import ManifestLoader
+from builder.modules.target import Target
+
+
+def read_instructions(path):
+    # docker takes a backslash followed by blanks as a line continuation
+    with open(path) as fp:
+        joined = re.sub(r'\\[ \t]*\n', ' ', fp.read())
+    return [line.split()[0].upper() for line in joined.splitlines() if line.strip()]
+
+
+def test_buildx_labels_leave_dockerfile_untouched(make_target):
+    target = Target(make_target())
+    target.update_dockerfile_with_label('buildx')
+
+    with open(target.dockerfile_path) as original, open(target.dockerfile_path + '.tmp') as revised:
+        assert revised.read() == original.read()
+
+
+def test_dockerfile_labels_come_last(make_target):
+    target = Target(make_target())
+    target.update_dockerfile_with_label('dockerfile')
+
+    instructions = read_instructions(target.dockerfile_path + '.tmp')
+    assert instructions.count('LABEL') == 1
+    assert instructions[-1] == 'LABEL'
+    for i, instruction in enumerate(instructions[:-1]):
+        if instruction == 'FROM':
+            assert instructions[i + 1] != 'LABEL'
+    with open(target.dockerfile_path + '.tmp') as fp:
+        assert 'ai.jina.hub.revision="abc1234"' in fp.read()
+
+
+def test_prepare_docker_cmd_passes_labels(make_target):
+    target = Target(make_target())
+    cmd = target.prepare_docker_cmd('jinaai/', 'jinaai/hub.encoders.dummy:0.0.1', push=False, label_mode='buildx')
+
+    labels = [cmd[i + 1] for i, arg in enumerate(cmd) if arg == '--label']
+    assert 'ai.jina.hub.name=Dummy' in labels
+    assert 'ai.jina.hub.revision=abc1234' in labels
+    assert len(labels) == len(target.get_labels())
+    assert cmd[cmd.index('--file') + 1] == target.dockerfile_path + '.tmp'
+    assert cmd[cmd.index('--platform') + 1] == 'linux/amd64,linux/arm64'
+    assert cmd[-2:] == ['--load', target.path]
+
+
+def test_prepare_docker_cmd_without_buildx_labels(make_target):
+    target = Target(make_target())
+    cmd = target.prepare_docker_cmd('jinaai/', 'jinaai/hub.encoders.dummy:0.0.1', push=True, label_mode='dockerfile')
+
+    assert '--label' not in cmd
+    assert '--push' in cmd
+
+
+def test_canonic_name(make_target):
+    target = Target(make_target('encoders/nlp/dummy'))
+
+    assert target.canonic_name == 'hub.encoders.nlp.dummy'
+    assert os.path.basename(target.dockerfile_path) == 'Dockerfile'
+
+
+def test_inspect_remote_image_from_registry_and_metadata(monkeypatch):
+    remote = {
+        'manifest': {'digest': 'sha256:list', 'config': {}},
+        'image': {
+            'linux/arm64': {'architecture': 'arm64', 'os': 'linux', 'created': '2021-01-02T00:00:00Z'},
+            'linux/amd64': {'architecture': 'amd64', 'os': 'linux', 'created': '2021-01-01T00:00:00Z',
+                            'config': {'Labels': {'ai.jina.hub.name': 'Dummy'}},
+                            'rootfs': {'type': 'layers', 'diff_ids': ['sha256:layer']}},
+        },
+    }
+    commands = []
+
+    def check_output(cmd, **kwargs):
+        commands.append(cmd)
+        return json.dumps(remote).encode()
+    monkeypatch.setattr(target_module.subprocess, 'check_output', check_output)
+
+    inspect = Target.inspect_remote_image('jinaai/hub.encoders.dummy:0.0.1',
+                                          {'containerimage.config.digest': 'sha256:config'})
+
+    assert commands == [['docker', 'buildx', 'imagetools', 'inspect', 'jinaai/hub.encoders.dummy:0.0.1',
+                         '--format', '{{json .}}']]
+    assert inspect['Id'] == 'sha256:config'
+    assert inspect['RepoDigests'] == ['jinaai/hub.encoders.dummy@sha256:list']
+    assert inspect['RepoTags'] == ['jinaai/hub.encoders.dummy:0.0.1', 'jinaai/hub.encoders.dummy:latest']
+    assert inspect['Platforms'] == ['linux/amd64', 'linux/arm64']
+    assert inspect['Architecture'] == 'amd64'
+    assert inspect['Config'] == {'Labels': {'ai.jina.hub.name': 'Dummy'}}
+    assert inspect['RootFS']['diff_ids'] == ['sha256:layer']
+
+
+def test_inspect_remote_single_platform_image(monkeypatch):
+    remote = {
+        'manifest': {'digest': 'sha256:manifest', 'config': {'digest': 'sha256:config'}},
+        'image': {'architecture': 'amd64', 'os': 'linux', 'config': {}, 'rootfs': {}},
+    }
+    monkeypatch.setattr(target_module.subprocess, 'check_output', lambda cmd, **kwargs: json.dumps(remote).encode())
+
+    inspect = Target.inspect_remote_image('localhost:5000/hub.encoders.dummy:0.0.1')
+
+    assert inspect['Id'] == 'sha256:config'
+    assert inspect['RepoDigests'] == ['localhost:5000/hub.encoders.dummy@sha256:manifest']
+    assert inspect['Platforms'] == ['linux/amd64']
+
+
+def stub_builds(target, monkeypatch, failing=()):
+    commands = []
+
+    def run(step, cmd, **kwargs):
+        commands.append(cmd)
+        if any(step == f'build {p}' for p in failing):
+            raise subprocess.CalledProcessError(1, cmd)
+        if '--metadata-file' in cmd:
+            arch = cmd[cmd.index('--platform') + 1].split('/')[-1]
+            with open(cmd[cmd.index('--metadata-file') + 1], 'w') as fp:
+                json.dump({'containerimage.digest': f'sha256:{arch}'}, fp)
+        return 0
+    monkeypatch.setattr(target.log, 'run', run)
+    return commands
+
+
+def test_split_platform_builds_assemble_manifest_list(make_target, monkeypatch):
+    target = Target(make_target())
+    target.content_image_name = 'jinaai/hub.encoders.dummy:sha-content'
+    commands = stub_builds(target, monkeypatch)
+
+    target.build_platforms('jinaai/', 'jinaai/hub.encoders.dummy:0.0.1', push=True)
+
+    builds = [cmd for cmd in commands if cmd[:3] == ['docker', 'buildx', 'build']]
+    assert sorted(cmd[cmd.index('--platform') + 1] for cmd in builds) == ['linux/amd64', 'linux/arm64']
+    # platform images are pushed by digest only, no temporary tag is left on the registry
+    assert all('-t' not in cmd and '--push' not in cmd for cmd in builds)
+    assert all(cmd[cmd.index('--output') + 1] == 'type=image,name=jinaai/hub.encoders.dummy,'
+                                                 'push-by-digest=true,name-canonical=true,push=true' for cmd in builds)
+    assert commands[-1] == ['docker', 'buildx', 'imagetools', 'create',
+                            '-t', 'jinaai/hub.encoders.dummy:0.0.1', '-t', 'jinaai/hub.encoders.dummy:latest',
+                            '-t', 'jinaai/hub.encoders.dummy:sha-content',
+                            'jinaai/hub.encoders.dummy@sha256:amd64',
+                            'jinaai/hub.encoders.dummy@sha256:arm64']
+    assert target.platform_report['linux/arm64']['Digest'] == 'sha256:arm64'
+    assert all(report['Status'] for report in target.platform_report.values())
+
+
+def test_failing_platform_reported_on_its_own(make_target, monkeypatch):
+    target = Target(make_target())
+    commands = stub_builds(target, monkeypatch, failing=['linux/arm64'])
+
+    with pytest.raises(RuntimeError, match='platforms linux/arm64 failed'):
+        target.build_platforms('jinaai/', 'jinaai/hub.encoders.dummy:0.0.1', push=True)
+
+    assert target.platform_report['linux/amd64']['Status'] is True
+    assert target.platform_report['linux/arm64'] == {
+        'Status': False, 'Image': 'jinaai/hub.encoders.dummy:0.0.1-linux-arm64',
+        'Error': 'docker buildx build exited with 1', 'Duration': target.platform_report['linux/arm64']['Duration'],
+    }
+    assert not any('imagetools' in cmd for cmd in commands)
+
+
+def without_label_values(cmd):
+    return [arg.split('=', 1)[0] if prev == '--label' else arg for prev, arg in zip([None] + cmd, cmd)]
+
+
+def test_new_revision_keeps_build_inputs(make_target, monkeypatch):
+    path = make_target()
+    builds = []
+    for revision in ('abc1234', 'def5678'):
+        monkeypatch.setattr(ManifestLoader, 'revision', revision)
+        target = Target(path)
+        target.update_dockerfile_with_label('buildx')
+        with open(target.dockerfile_path + '.tmp', 'rb') as fp:
+            dockerfile = fp.read()
+        cmd = target.prepare_docker_cmd('jinaai/', 'jinaai/hub.encoders.dummy:0.0.1', push=True)
+        builds.append((dockerfile, cmd))
+
+    (first_dockerfile, first_cmd), (second_dockerfile, second_cmd) = builds
+    # only the --label values tell the builds apart, and labels are not part of any cached layer
+    assert first_dockerfile == second_dockerfile
+    assert first_cmd != second_cmd
+    assert without_label_values(first_cmd) == without_label_values(second_cmd)
+
+
+def has_buildx():
+    if not shutil.which('docker'):
+        return False
+    try:
+        subprocess.check_call(['docker', 'buildx', 'inspect'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not has_buildx(), reason='needs docker buildx')
+def test_second_build_served_from_cache(make_target, monkeypatch):
+    path = make_target(dockerfile='FROM scratch\nCOPY manifest.yml /manifest.yml\nCOPY Dockerfile /Dockerfile\n')
+    image_name = 'hub-builder-test/hub.encoders.dummy:cache'
+    host_platform = Target.get_host_platform(['linux/amd64', 'linux/arm64']) or 'linux/amd64'
+    outputs = []
+    try:
+        for revision in ('abc1234', 'def5678'):
+            monkeypatch.setattr(ManifestLoader, 'revision', revision)
+            target = Target(path)
+            target.update_dockerfile_with_label('buildx')
+            cmd = target.prepare_docker_cmd('hub-builder-test/', image_name, push=False, platforms=[host_platform])
+            outputs.append(subprocess.run(cmd[:3] + ['--progress', 'plain'] + cmd[3:], check=True,
+                                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.decode())
+    finally:
+        subprocess.call(['docker', 'rmi', '-f', image_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    steps = re.findall(r'^(#\d+) \[\d+/\d+\]', outputs[1], flags=re.MULTILINE)
+    assert steps
+    for step in steps:
+        assert f'{step} CACHED' in outputs[1]
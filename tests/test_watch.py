@@ -0,0 +1,41 @@
+import os
+from types import SimpleNamespace
+
+from builder.modules.watch import HubWatcher
+
+
+class Discovery:
+
+    def __init__(self, path):
+        self.path = path
+
+    def iter_files(self):
+        for dir_path, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                yield os.path.join(dir_path, file_name)
+
+
+def test_changed_files_map_to_their_target(make_target, hub):
+    target = os.path.abspath(make_target('hub/encoders/dummy', files={'src/model/encoder.py': 'x = 1\n'}))
+    os.makedirs(hub / 'hub' / 'encoders' / 'loose')
+    (hub / 'hub' / 'encoders' / 'loose' / 'notes.py').write_text('')
+    builder = SimpleNamespace(discovery=Discovery(str(hub / 'hub')), _index=None, _fingerprint=None)
+    watcher = HubWatcher(builder, state=None, history={'Images': {}})
+    watcher.mtimes = watcher.snapshot()
+
+    with open(os.path.join(target, 'src', 'model', 'encoder.py'), 'a') as fp:
+        fp.write('y = 2\n')
+    os.utime(os.path.join(target, 'src', 'model', 'encoder.py'), ns=(0, 1))
+    (hub / 'hub' / 'encoders' / 'loose' / 'notes.py').write_text('changed')
+    os.utime(hub / 'hub' / 'encoders' / 'loose' / 'notes.py', ns=(0, 1))
+    watcher.poll()
+
+    assert list(watcher.pending) == [target]
+
+
+def test_target_dir_stays_inside_hub(hub):
+    builder = SimpleNamespace(discovery=Discovery(str(hub / 'hub')))
+    (hub / 'manifest.yml').write_text('')
+    watcher = HubWatcher(builder, state=None, history={'Images': {}})
+
+    assert watcher.get_target_dir(str(hub / 'hub' / 'README.md')) is None